@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from src.request import async_api_requests
+from src.governor import RunGovernor
+from src.mock_server import MockChatServer, MockServerConfig, start_mock_server
+
+# Load test of async_api_requests against the local mock server (src/mock_server.py).
+# No real API calls are made; results go to a temporary directory. Rates are measured from
+# the server's request arrivals after the dispatcher's initial full bucket has been spent.
+
+def build_items(num_items, prompt_words):
+    words = ' '.join(['vulnerability'] * prompt_words)
+    return [{'id': f'load-{i}', 'prompt': [{'role': 'user', 'content': f'Bug report {i}: {words}'}], 'ground_truth': ''}
+            for i in range(num_items)]
+
+async def run_level(rpm, args):
+    config = MockServerConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        error_rate_5xx=args.error_rate,
+        max_requests_per_minute=rpm * args.server_headroom if args.server_limits else None,
+        max_tokens_per_minute=args.tpm * args.server_headroom if args.server_limits else None,
+    )
+    server = MockChatServer(config)
+    runner = await start_mock_server(server, port=args.port)
+
+    # The dispatcher starts with a full bucket of `rpm` requests; send that burst plus
+    # `minutes` of steady-state traffic and measure only the part after the burst
+    num_items = rpm + max(int(rpm * args.minutes), 1)
+    data = build_items(num_items, args.prompt_words)
+    start = time.time()
+    with tempfile.TemporaryDirectory() as result_dir:
+        status_tracker = await async_api_requests(
+            max_requests_per_minute=rpm,
+            max_tokens_per_minute=args.tpm,
+            request_url=f"http://127.0.0.1:{args.port}/v1/chat/completions",
+            api_key='mock',
+            root_path=result_dir,
+            result_file_path=result_dir,
+            result_file_name='loadtest',
+            task='loadtest',
+            dataset='loadtest',
+            dataNum=0,
+            testNum=num_items,
+            data=data,
+        )
+    elapsed = time.time() - start
+    await runner.cleanup()
+
+    server_summary = server.summary()
+    steady = sorted(server.stats.arrival_times)[rpm:]
+    steady_seconds = steady[-1] - steady[0] if len(steady) > 1 else 0
+    achieved_rpm = (len(steady) - 1) / steady_seconds * 60 if steady_seconds else 0
+    tokens_per_request = (status_tracker.prompt_tokens_used + status_tracker.completion_tokens_used) / max(status_tracker.num_tasks_succeeded, 1)
+    achieved_tpm = achieved_rpm * tokens_per_request
+    return {
+        'rpm': rpm,
+        'items': num_items,
+        'elapsed': elapsed,
+        'achieved_rpm': achieved_rpm,
+        'rpm_utilization': achieved_rpm / rpm,
+        'tpm_utilization': achieved_tpm / args.tpm,
+        'retries': status_tracker.num_attempts - status_tracker.num_tasks_started,
+        'rate_limited': status_tracker.num_rate_limit_errors,
+        'failed': status_tracker.num_tasks_failed - status_tracker.num_items_swept,
+        'latency': server_summary['latency_percentiles'],
+    }
+
+async def check_cost_cap(max_cost, args, num_items=20, timeout=120):
+    """Runs a small batch under a tight cost cap and checks that it stops cleanly.
+
+    The run must end on its own with the cap as stop reason and a resume manifest written,
+    instead of holding back the next request forever.
+    """
+    server = MockChatServer(MockServerConfig(latency='constant', latency_mean=0.05))
+    runner = await start_mock_server(server, port=args.port)
+    governor = RunGovernor(model='gpt-4o-mini', max_cost=max_cost, max_requests_per_minute=1000, max_tokens_per_minute=args.tpm)
+    try:
+        with tempfile.TemporaryDirectory() as result_dir:
+            status_tracker = await asyncio.wait_for(async_api_requests(
+                max_requests_per_minute=1000,
+                max_tokens_per_minute=args.tpm,
+                request_url=f"http://127.0.0.1:{args.port}/v1/chat/completions",
+                api_key='mock',
+                root_path=result_dir,
+                result_file_path=result_dir,
+                result_file_name='costcap',
+                task='loadtest',
+                dataset='loadtest',
+                dataNum=0,
+                testNum=num_items,
+                data=build_items(num_items, args.prompt_words),
+                governor=governor,
+            ), timeout)
+            manifest_written = os.path.exists(os.path.join(result_dir, 'costcap_resume.json'))
+    finally:
+        await runner.cleanup()
+    finished = status_tracker.num_tasks_succeeded + status_tracker.num_tasks_failed - status_tracker.num_items_swept
+    ok = finished == num_items or (governor.stop_reason is not None and manifest_written)
+    print(f"Cost cap ${max_cost}: {finished}/{num_items} items, spent ${governor.spent(status_tracker):.4f}, "
+          f"stop reason: {governor.stop_reason}, manifest written: {manifest_written} -> {'OK' if ok else 'FAILED'}")
+    return ok
+
+def print_report(reports):
+    print("\n" + "="*100)
+    print("DISPATCHER LOAD TEST (mock server)")
+    print("-"*100)
+    print(f"{'RPM':>8} | {'Items':>7} | {'Time (s)':>8} | {'Achieved':>9} | {'RPM util':>8} | {'TPM util':>8} | {'Retries':>7} | {'429s':>6} | {'p50/p90/p99 latency (s)':>24}")
+    print("-"*100)
+    for r in reports:
+        latency = r['latency']
+        latency_text = '/'.join(f"{latency.get(p, 0):.2f}" for p in ('p50', 'p90', 'p99'))
+        print(f"{r['rpm']:>8} | {r['items']:>7} | {r['elapsed']:>8.1f} | {r['achieved_rpm']:>9.0f} | {r['rpm_utilization']:>8.1%} | {r['tpm_utilization']:>8.1%} | {r['retries']:>7} | {r['rate_limited']:>6} | {latency_text:>24}")
+    print("="*100)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test async_api_requests against a local mock server')
+    parser.add_argument('--rpm', type=int, nargs='+', default=[1000, 5000, 20000, 50000], help='dispatcher RPM levels to test')
+    parser.add_argument('--tpm', type=float, default=100_000_000)
+    parser.add_argument('--minutes', type=float, default=2, help='steady-state minutes per level, measured after the initial burst of rpm requests')
+    parser.add_argument('--prompt-words', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal', choices=['constant', 'uniform', 'lognormal'])
+    parser.add_argument('--latency-mean', type=float, default=0.8)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of injected 5xx responses')
+    parser.add_argument('--server-limits', action='store_true', help='let the mock server enforce RPM/TPM with 429s')
+    parser.add_argument('--server-headroom', type=float, default=1.0, help='server limit as a multiple of the dispatcher limit')
+    parser.add_argument('--check-cost-cap', type=float, nargs='+', default=None, metavar='USD',
+                        help='instead of the load test, check that runs under these cost caps run to completion')
+    args = parser.parse_args()
+
+    if args.check_cost_cap:
+        results = [asyncio.run(check_cost_cap(max_cost, args)) for max_cost in args.check_cost_cap]
+        raise SystemExit(0 if all(results) else 1)
+
+    reports = [asyncio.run(run_level(rpm, args)) for rpm in args.rpm]
+    print_report(reports)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,20 @@
 import asyncio
 import os
 import json
+import time
 from dotenv import load_dotenv  # New import
 from src import prompt
 from src.request import async_api_requests
 from src.metrics import calculate_title_metrics
+from src.governor import RunGovernor, estimate_cost
+from src.profiles import LABELS, get_request_profile, label_answer_tokens
+from src import classify
+from src import cvss
+from src import trace
+from src.trace import ChromeTracer
+from src.breaker import CircuitBreaker
+from src import planner
+from src.tokens import warm_encoding, TokenEstimator
 
 # Load variables from .env file
 load_dotenv()
@@ -17,7 +27,7 @@ def get_user_input(prompt_text, options=None):
             continue
         return val
 
-def print_token_summary(filepath):
+def print_token_summary(filepath, model="gpt-4o-mini"):
     """Parses the result JSON to calculate total tokens and estimated cost."""
     if not os.path.exists(filepath):
         return
@@ -41,10 +51,7 @@ def print_token_summary(filepath):
             total_completion += usage.get('completion_tokens', 0)
             successful_requests += 1
 
-    # Cost Calculation for gpt-4o-mini
-    input_cost = (total_prompt / 1_000_000) * 0.15
-    output_cost = (total_completion / 1_000_000) * 0.60
-    total_cost = input_cost + output_cost
+    total_cost = estimate_cost(model, total_prompt, total_completion)
 
     summary_output = (
         f"\n" + "="*55 + "\n"
@@ -69,7 +76,7 @@ def main():
     print("\n[1] Select Task:")
     print("1. title (dataset: title_itape)")
     print("2. SBRP  (dataset: Chromium)")
-    print("3. cvss  (dataset: AV, AC, PR, or UI)")
+    print("3. cvss  (dataset: AV, AC, PR, UI, or combined)")
     print("4. vulfix(dataset: vulfix_extractfix)")
     print("5. APCA  (dataset: APCA_quatrain, APCA_panther, or APCA_invalidator)")
     print("6. stable(dataset: stable_patchnet)")
@@ -122,6 +129,8 @@ def main():
         print("API Key loaded successfully from .env")
         
     model = input("Model (default: gpt-4o-mini): ") or "gpt-4o-mini"
+    # Load the tokenizer in the background while the remaining options are entered
+    warm_encoding(model)
     test_num = int(input("Number of items to test (default 1): ") or 1)
 
     # --- DYNAMIC RATE LIMIT LOGIC ---
@@ -135,22 +144,121 @@ def main():
         rpm = 3
         tpm = 40000
     print(f"Rate limits set for {model}: {rpm} RPM, {tpm} TPM")
+
+    # --- BUDGET / DEADLINE GOVERNOR ---
+    max_cost = input("Cost cap in USD (default: none): ").strip()
+    finish_in = input("Finish within N minutes (default: none): ").strip()
+    governor = None
+    if max_cost or finish_in:
+        governor = RunGovernor(
+            model=model,
+            max_cost=float(max_cost) if max_cost else None,
+            deadline=time.time() + float(finish_in) * 60 if finish_in else None,
+            max_requests_per_minute=rpm,
+            max_tokens_per_minute=tpm,
+        )
     
+    metrics_port = input("Metrics exporter port (default: off): ").strip()
+    metrics_port = int(metrics_port) if metrics_port else None
+    # Bind to 0.0.0.0 (or the host's address) for a dashboard that is not on this machine
+    metrics_host = (input("Metrics exporter host (default: 127.0.0.1): ").strip() or '127.0.0.1') if metrics_port else '127.0.0.1'
+    trace_attempts = input("Write per-attempt trace file? (y/N): ").strip().lower() == 'y'
+    ordered_output = input("Also write results in input order? (y/N): ").strip().lower() == 'y'
+    sweep_passes = int(input("Failed-item sweep passes at the end of the run (default 0): ").strip() or 0)
+    sweep_concurrency = int(input("Sweep concurrency (default 8): ").strip() or 8) if sweep_passes else 8
+    tracer = ChromeTracer() if input("Write Chrome trace timeline? (y/N): ").strip().lower() == 'y' else None
+    token_estimator = TokenEstimator(model) if input("Schedule on estimated token counts (faster start on large runs)? (y/N): ").strip().lower() == 'y' else None
+    truncation = get_user_input("Truncation of oversize items: head, tail or head_tail (default: head): ",
+                                options=['', 'head', 'tail', 'head_tail']) or 'head'
+    compress_context = input("Compress bug reports (dedupe traces/logs, strip boilerplate) before truncation? (y/N): ").strip().lower() == 'y'
+    drop_stopwords = compress_context and input("Also drop stopwords? (y/N): ").strip().lower() == 'y'
+
     # 6. SETUP & EXECUTION
     root_data_path = os.path.join(os.getcwd(), 'data')
     result_output_path = os.path.join(os.getcwd(), 'results', task)
-    dynamic_filename = f"{task}_{method}_{test_val}"
+    combined_cvss = task == "cvss" and dataset == cvss.COMBINED_DATASET
+    if combined_cvss and method not in cvss.COMBINED_METHODS:
+        print(f"[ERROR] Combined cvss only supports the zero-shot methods {', '.join(cvss.COMBINED_METHODS)}; "
+              f"run '{method}' on the single-metric datasets (AV, AC, PR, UI) instead.")
+        return
+    # Combined results are kept apart from the single-metric runs of the same method
+    dynamic_filename = f"{task}_combined_{method}_{test_val}" if combined_cvss else f"{task}_{method}_{test_val}"
     evaluation_full_result_path = os.path.join(result_output_path, dynamic_filename + ".json")
 
     print(f"\n--- Generating prompts for {task}/{dataset} ---")
-    generated_prompts = prompt.generate_prompt(
-        root=root_data_path,
-        task=task,
-        dataset=dataset,
-        method=method,
-        TEST=test_val,
-        testNum=test_num
-    )
+    with trace.span(tracer, 'generate prompts', task=task, dataset=dataset):
+        if combined_cvss:
+            # One request per vulnerability for all four metrics, split back per metric afterwards
+            generated_prompts = cvss.generate_combined_prompt(
+                root=root_data_path,
+                method=method,
+                TEST=test_val,
+                testNum=test_num
+            )
+        else:
+            generated_prompts = prompt.generate_prompt(
+                root=root_data_path,
+                task=task,
+                dataset=dataset,
+                method=method,
+                TEST=test_val,
+                testNum=test_num,
+                token_model=model,
+                compress_context=compress_context,
+                drop_stopwords=drop_stopwords,
+                truncation=truncation
+            )
+
+    request_profile = get_request_profile(task, dataset, method, generated_prompts, model)
+    response_parser = None
+    if combined_cvss:
+        request_profile = cvss.COMBINED_REQUEST_PROFILE
+        response_parser = cvss.combined_response_parser
+    temperature = 0
+    choices = 1
+    if dataset in LABELS and method != 'summary':
+        labels = LABELS[dataset]
+        use_logprobs = input("Single-token classification with label probabilities? (y/N): ").strip().lower() == 'y'
+        if use_logprobs:
+            try:
+                logprob_profile = classify.classification_request_params(labels, model)
+                logprob_parser = classify.label_response_parser(labels, model)
+            except ValueError as e:
+                print(f"[WARNING] Single-token classification unavailable ({e}); using the plain request profile.")
+                use_logprobs = False
+        if use_logprobs:
+            classify.constrain_prompts(generated_prompts, labels)
+            request_profile = logprob_profile
+            response_parser = logprob_parser
+        # Self-consistency: k samples share one prompt in a single request (n=k) and are voted
+        choices = int(input("Self-consistency samples per item (default 1): ") or 1)
+        if choices > 1:
+            temperature = 0.7
+            response_parser = classify.vote_response_parser(labels, model, logprobs=use_logprobs)
+    if request_profile:
+        print(f"Request profile for {task}/{dataset}: {request_profile}")
+
+    if input("Dry run only (plan cost and duration, no API calls)? (y/N): ").strip().lower() == 'y':
+        latency = float(input("Expected request latency in seconds (default 1.0): ") or 1.0)
+        max_completion_tokens = min(request_profile.get('max_tokens', 0), 8000)
+        # The cap is what the dispatcher reserves; the cost projection uses a typical answer length
+        expected_completion_tokens = 50
+        if dataset in LABELS and max_completion_tokens:
+            expected_completion_tokens = 1 if request_profile.get('logprobs') else label_answer_tokens(LABELS[dataset], model)
+        if max_completion_tokens:
+            expected_completion_tokens = min(expected_completion_tokens, max_completion_tokens)
+        plan = planner.plan_run(
+            generated_prompts[:test_num],
+            model,
+            rpm,
+            tpm,
+            max_completion_tokens=max_completion_tokens,
+            choices=choices,
+            expected_completion_tokens=expected_completion_tokens,
+            latency=latency,
+        )
+        print(planner.format_plan(plan, model, rpm, tpm))
+        return
 
     print(f"--- Starting API Requests. Output: {dynamic_filename}.json ---")
     request_url = "https://api.openai.com/v1/chat/completions"
@@ -170,12 +278,31 @@ def main():
             dataNum=0,
             testNum=test_num,
             method=method,
-            data=generated_prompts
+            temperature=temperature,
+            choices=choices,
+            data=generated_prompts,
+            governor=governor,
+            request_profile=request_profile,
+            response_parser=response_parser,
+            metrics_port=metrics_port,
+            metrics_host=metrics_host,
+            trace_attempts=trace_attempts,
+            tracer=tracer,
+            circuit_breaker=CircuitBreaker(),
+            sweep_passes=sweep_passes,
+            sweep_concurrency=sweep_concurrency,
+            ordered_output=ordered_output,
+            token_estimator=token_estimator,
+            truncation=truncation,
         )
     )
 
     # 7. AUTOMATED EVALUATION & TOKEN SUMMARY
-    token_report = print_token_summary(evaluation_full_result_path)
+    token_report = print_token_summary(evaluation_full_result_path, model)
+
+    if combined_cvss and os.path.exists(evaluation_full_result_path):
+        for metric_file in cvss.split_combined_results(evaluation_full_result_path, result_output_path, dynamic_filename):
+            print(f"[Success] Per-metric results saved to: {metric_file}")
 
     if task == "title" and os.path.exists(evaluation_full_result_path):
         report = calculate_title_metrics(evaluation_full_result_path)
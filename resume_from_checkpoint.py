@@ -115,19 +115,17 @@ def main():
         print("⚠️  No existing Part 2 found, starting fresh")
     
     print(f"\n--- Generating prompts for remaining items ---")
-    generated_prompts = prompt.generate_prompt(
+    # Only the remaining items (from index start_from_index onwards) are read and prompted
+    remaining_prompts = prompt.generate_prompt(
         root=root_data_path,
         task=task,
         dataset=dataset,
         method=method,
         TEST=test_val,
-        testNum=total_items
+        testNum=total_items - start_from_index,
+        start=start_from_index
     )
     
-    print(f"Total prompts generated: {len(generated_prompts)}")
-    
-    # Extract only remaining items (from index start_from_index onwards)
-    remaining_prompts = generated_prompts[start_from_index:]
     print(f"Remaining prompts to process: {len(remaining_prompts)}")
     print(f"First ID in remaining batch: {remaining_prompts[0]['id']}")
     print(f"Last ID in remaining batch: {remaining_prompts[-1]['id']}")
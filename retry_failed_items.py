@@ -35,16 +35,16 @@ dataset = "title_itape"
 method = "few-shot"
 test_val = "test"
 
-all_prompts = prompt.generate_prompt(
+# Random access by id: only the failed items are read (instant with a compiled dataset store)
+failed_prompts = prompt.generate_prompt(
     root=os.path.join(os.getcwd(), 'data'),
     task=task,
     dataset=dataset,
     method=method,
     TEST=test_val,
-    testNum=33438
+    testNum=len(failed_ids),
+    ids=failed_ids
 )
-
-failed_prompts = [p for p in all_prompts if p['id'] in failed_ids]
 print(f"✅ Found {len(failed_prompts)} prompts for failed items")
 
 # Step 3: Confirm
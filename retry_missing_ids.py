@@ -3,6 +3,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 from src import prompt
+from src.dataset import open_dataset_store
 from src.request import async_api_requests
 
 load_dotenv()
@@ -34,16 +35,13 @@ if not os.path.exists(dataset_path):
     print(f"❌ Dataset not found: {dataset_path}")
     exit(1)
 
-with open(dataset_path, 'r') as f:
-    dataset_raw = json.load(f)
-
-# Extract actual data from dict structure
-if isinstance(dataset_raw, dict) and 'title_itape' in dataset_raw:
-    original_data = dataset_raw['title_itape']
-    print(f"✅ Original dataset: {len(original_data)} items (dict format)")
+# Only a compiled dataset store can tell the size without reading the whole split
+store = open_dataset_store(dataset_path)
+if store is not None:
+    print(f"✅ Original dataset: {store.count('title_itape')} items")
+    store.close()
 else:
-    original_data = dataset_raw
-    print(f"✅ Original dataset: {len(original_data)} items")
+    print(f"✅ Original dataset: {dataset_path} (not compiled; run python -m src.dataset for its size)")
 
 # Step 3: Generate prompts for missing IDs only
 print("\n[STEP 3] Generating prompts for missing IDs...")
@@ -52,23 +50,18 @@ dataset = "title_itape"
 method = "few-shot"
 test_val = "test"
 
-# Generate all prompts first
-all_prompts = prompt.generate_prompt(
+# Random access by id: only the missing items are read (instant with a compiled dataset store)
+missing_ids = [f"title-{i}" for i in missing]
+missing_prompts = prompt.generate_prompt(
     root=os.path.join(os.getcwd(), 'data'),
     task=task,
     dataset=dataset,
     method=method,
     TEST=test_val,
-    testNum=33438
+    testNum=len(missing_ids),
+    ids=missing_ids
 )
 
-# Filter only missing IDs
-missing_prompts = []
-for p in all_prompts:
-    prompt_id = int(p['id'].split('-')[1])
-    if prompt_id in missing:
-        missing_prompts.append(p)
-
 print(f"✅ Found {len(missing_prompts)} prompts for missing IDs")
 
 if len(missing_prompts) == 0:
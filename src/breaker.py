@@ -0,0 +1,80 @@
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+@dataclass
+class CircuitBreaker:
+    """Pauses dispatch while the provider is failing with 5xx or connection errors.
+
+    Closed: every request is dispatched and transient failures are tracked over a sliding
+    window. When the failure rate crosses the threshold the breaker opens and dispatch stops
+    for `open_seconds`. It then goes half-open and lets `max_probes` probe requests through:
+    a successful probe closes it, a failed one re-opens it with a doubled pause (up to
+    `max_open_seconds`). Failures while the breaker is not closed give their attempt back.
+    """
+    window_seconds: float = 30
+    min_requests: int = 20
+    failure_rate_threshold: float = 0.5
+    open_seconds: float = 15
+    max_open_seconds: float = 300
+    max_probes: int = 1
+    state: str = CLOSED
+    outcomes: deque = field(default_factory=deque)  # (time, failed)
+    opened_at: float = 0
+    current_open_seconds: float = 0
+    probes_in_flight: int = 0
+    num_trips: int = 0
+
+    def allow_dispatch(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.time() - self.opened_at < self.current_open_seconds:
+                return False
+            self.state = HALF_OPEN
+            logger.warning("Circuit breaker half-open: probing provider")
+        return self.probes_in_flight < self.max_probes
+
+    def on_dispatch(self):
+        """Returns True if the dispatched request is a half-open probe."""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight += 1
+            return True
+        return False
+
+    def record(self, failed, probe=False):
+        """Records a transient failure or a success (other errors are not passed in)."""
+        now = time.time()
+        if probe:
+            self.probes_in_flight -= 1
+        if self.state == HALF_OPEN and probe:
+            if failed:
+                self.trip(now, min(self.current_open_seconds * 2, self.max_open_seconds))
+            else:
+                self.state = CLOSED
+                self.outcomes.clear()
+                logger.warning("Circuit breaker closed: provider recovered")
+            return
+        if self.state != CLOSED:
+            return
+        self.outcomes.append((now, failed))
+        while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+            self.outcomes.popleft()
+        if len(self.outcomes) >= self.min_requests:
+            failures = sum(1 for _, f in self.outcomes if f)
+            if failures / len(self.outcomes) >= self.failure_rate_threshold:
+                self.trip(now, self.open_seconds)
+
+    def trip(self, now, open_seconds):
+        self.state = OPEN
+        self.opened_at = now
+        self.current_open_seconds = open_seconds
+        self.num_trips += 1
+        logger.warning(f"Circuit breaker open for {open_seconds:.0f}s: provider error storm")
@@ -0,0 +1,124 @@
+import math
+from src import tokens
+
+# logit_bias of +100 effectively restricts sampling to the biased tokens
+LABEL_BIAS = 100
+
+def label_first_tokens(labels, model="gpt-4o-mini"):
+    """Returns {first token id: label}; the first token must tell the labels apart."""
+    encoding = tokens.get_encoding(model)
+    first_tokens = {}
+    for label in labels:
+        token_id = encoding.encode(label)[0]
+        if token_id in first_tokens:
+            raise ValueError(f"labels {first_tokens[token_id]!r} and {label!r} share their first token")
+        first_tokens[token_id] = label
+    return first_tokens
+
+def classification_request_params(labels, model="gpt-4o-mini"):
+    """Returns request parameters for a one-token answer constrained to the label set."""
+    first_tokens = label_first_tokens(labels, model)
+    return {
+        'max_tokens': 1,
+        'logprobs': True,
+        'top_logprobs': min(len(labels), 20),
+        'logit_bias': {token_id: LABEL_BIAS for token_id in first_tokens},
+    }
+
+def constrain_prompts(prompts, labels):
+    """Appends the allowed answers to the last user message of every prompt item."""
+    instruction = '\nAnswer with exactly one of: ' + ', '.join(labels) + '.'
+    for item in prompts:
+        last = item['prompt'][-1]
+        item['prompt'][-1] = {**last, 'content': last['content'] + instruction}
+        # An indexed count no longer matches the prompt; the dispatcher recounts it
+        item.pop('prompt_tokens', None)
+    return prompts
+
+def label_token_strings(labels, model="gpt-4o-mini"):
+    """Returns {first token text: label}, matching the 'token' field of top_logprobs."""
+    encoding = tokens.get_encoding(model)
+    return {encoding.decode([token_id]): label for token_id, label in label_first_tokens(labels, model).items()}
+
+def label_probs_from_logprobs(top_logprobs, labels, token_to_label):
+    """Returns {label: probability} normalised over the labels from one token's top_logprobs."""
+    probs = dict.fromkeys(labels, 0.0)
+    for entry in top_logprobs:
+        label = token_to_label.get(entry['token'])
+        if label is not None:
+            probs[label] += math.exp(entry['logprob'])
+    total = sum(probs.values())
+    if total > 0:
+        probs = {label: p / total for label, p in probs.items()}
+    return probs
+
+def label_response_parser(labels, model="gpt-4o-mini"):
+    """Returns a response parser that adds 'label' and 'label_probs' to each result."""
+    token_to_label = label_token_strings(labels, model)
+
+    def parse(response):
+        try:
+            top_logprobs = response['choices'][0]['logprobs']['content'][0]['top_logprobs']
+        except (KeyError, IndexError, TypeError):
+            return {}
+        probs = label_probs_from_logprobs(top_logprobs, labels, token_to_label)
+        if not any(probs.values()):
+            return {'label': None, 'label_probs': probs}
+        return {'label': max(probs, key=probs.get), 'label_probs': probs}
+    return parse
+
+def parse_label(text, labels):
+    """Returns the label named in a free-text answer (e.g. 'Category: NAK'), or None."""
+    if not text:
+        return None
+    text = text.split('Category:')[-1].strip().lower()
+    # Longest label first so "non-security bug report" is not read as "security bug report"
+    for label in sorted(labels, key=len, reverse=True):
+        if text.startswith(label.lower()):
+            return label
+    for label in sorted(labels, key=len, reverse=True):
+        if label.lower() in text:
+            return label
+    return None
+
+def vote_response_parser(labels, model="gpt-4o-mini", logprobs=False):
+    """Returns a response parser that majority-votes the labels of all n choices.
+
+    Adds 'label', 'votes' and 'agreement' (share of choices voting for the winner). With
+    logprobs the per-choice label probabilities are averaged into 'label_probs' and the
+    label with the highest mean probability wins instead.
+    """
+    token_to_label = label_token_strings(labels, model) if logprobs else None
+
+    def parse(response):
+        try:
+            response_choices = response['choices']
+        except (KeyError, TypeError):
+            return {}
+        votes = dict.fromkeys(labels, 0)
+        mean_probs = dict.fromkeys(labels, 0.0)
+        for choice in response_choices:
+            if logprobs:
+                try:
+                    top_logprobs = choice['logprobs']['content'][0]['top_logprobs']
+                except (KeyError, IndexError, TypeError):
+                    continue
+                probs = label_probs_from_logprobs(top_logprobs, labels, token_to_label)
+                for label, p in probs.items():
+                    mean_probs[label] += p / len(response_choices)
+                label = max(probs, key=probs.get) if any(probs.values()) else None
+            else:
+                label = parse_label((choice.get('message') or {}).get('content'), labels)
+            if label is not None:
+                votes[label] += 1
+        if not any(votes.values()):
+            return {'label': None, 'votes': votes, 'agreement': 0.0}
+        if logprobs:
+            winner = max(mean_probs, key=mean_probs.get)
+        else:
+            winner = max(votes, key=votes.get)
+        result = {'label': winner, 'votes': votes, 'agreement': votes[winner] / len(response_choices)}
+        if logprobs:
+            result['label_probs'] = mean_probs
+        return result
+    return parse
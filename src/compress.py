@@ -0,0 +1,81 @@
+import re
+import string
+from src import tokens
+
+# Lines that carry no information for classification: bug-tracker templates and browser noise
+BOILERPLATE_PATTERNS = [
+    re.compile(r'^\s*User[- ]?Agent\s*:', re.IGNORECASE),
+    re.compile(r'^\s*Please (use labels and text|enter a one-line summary|provide any additional information)', re.IGNORECASE),
+    re.compile(r'^\s*This template is ONLY for', re.IGNORECASE),
+    re.compile(r'^\s*(Reported|Posted) by .* on .*$', re.IGNORECASE),
+    re.compile(r'^\s*-{3,}\s*(Additional )?Comment.*-{3,}\s*$', re.IGNORECASE),
+]
+
+# Stack frames (gdb/ASan "#3 0x...", Java "at pkg.Class.method(", Python 'File "..."') and timestamped log lines
+FRAME_PATTERN = re.compile(r'^\s*(#\d+\s|at\s+[\w$.<>/]+\(|File\s+")')
+LOG_PATTERN = re.compile(r'^\s*\[?\d{1,4}[-/:]\d{1,2}[-/:]\d{1,4}')
+# Parts of a frame or log line that change from run to run: addresses, dates and times of day
+VOLATILE_PATTERN = re.compile(r'0x[0-9a-fA-F]+|\b\d{4}[-/]\d{1,2}[-/]\d{1,2}\b|\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b')
+
+def strip_boilerplate(text):
+    return '\n'.join(line for line in text.split('\n') if not any(pattern.match(line) for pattern in BOILERPLATE_PATTERNS))
+
+def collapse_whitespace(text):
+    # Leading indentation is kept: it is meaningful in code and diff context lines
+    text = re.sub(r'(?<=\S)[ \t]{2,}', ' ', text)
+    text = re.sub(r'[ \t]+(?=\n|$)', '', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip('\n')
+
+def dedupe_lines(text):
+    """Collapses runs of identical lines and drops stack frames and log lines seen before.
+
+    Frames and log lines are compared with addresses and timestamps masked, so the same
+    frame at another address or the same log message at another time counts as seen;
+    line numbers and other values are kept, so frames at different lines stay distinct.
+    """
+    kept = []
+    seen = set()
+    previous = None
+    repeats = 0
+    for line in text.split('\n'):
+        if line.strip() and line == previous:
+            repeats += 1
+            continue
+        if repeats:
+            kept.append(f'[previous line repeated {repeats} more times]')
+            repeats = 0
+        previous = line
+        if FRAME_PATTERN.match(line) or LOG_PATTERN.match(line):
+            key = VOLATILE_PATTERN.sub('#', line.strip())
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(line)
+    if repeats:
+        kept.append(f'[previous line repeated {repeats} more times]')
+    return '\n'.join(kept)
+
+def nltk_stopwords_process(language='english'):
+    """Returns a `stopwords_process` hook that drops nltk stopwords, keeping line breaks."""
+    from nltk.corpus import stopwords
+    try:
+        words = set(stopwords.words(language))
+    except LookupError:
+        raise RuntimeError("nltk stopwords corpus missing; run: python -m nltk.downloader stopwords")
+
+    def remove_stopwords(text):
+        return '\n'.join(' '.join(word for word in line.split(' ') if word.lower().strip(string.punctuation) not in words)
+                         for line in text.split('\n'))
+    return remove_stopwords
+
+def compress_text(text, stopwords_process=None):
+    """Shrinks a bug report or log without dropping distinct content (stopwords aside)."""
+    text = dedupe_lines(strip_boilerplate(text))
+    if stopwords_process:
+        text = stopwords_process(text)
+    return collapse_whitespace(text)
+
+def compress_field(text, stopwords_process=None, model="gpt-4o-mini"):
+    """Returns (compressed text, tokens saved)."""
+    compressed = compress_text(text, stopwords_process)
+    return compressed, tokens.num_tokens_from_text(text, model) - tokens.num_tokens_from_text(compressed, model)
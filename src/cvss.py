@@ -0,0 +1,114 @@
+import os
+import json
+import copy
+from tqdm import tqdm
+from src import tokens
+from src.profiles import LABELS
+
+CVSS_METRICS = ['AV', 'AC', 'PR', 'UI']
+COMBINED_DATASET = 'combined'
+
+METRIC_NAMES = {
+    'AV': 'Attack Vector',
+    'AC': 'Attack Complexity',
+    'PR': 'Privileges Required',
+    'UI': 'User Interaction',
+}
+
+# The combined prompt is zero-shot: the one-shot/few-shot/summary shots of the cvss prompt
+# files answer a single metric and cannot be reused for a four-metric JSON answer
+COMBINED_METHODS = ('base', 'manual-info')
+
+# JSON answer of at most four short labels
+COMBINED_REQUEST_PROFILE = {'response_format': {'type': 'json_object'}, 'max_tokens': 60}
+
+def combined_system_prompt():
+    lines = ['You are a security expert assessing the CVSS base metrics of a vulnerable function.',
+             'Answer with a JSON object with the keys ' + ', '.join(CVSS_METRICS) + ' and one of these values each:']
+    for metric in CVSS_METRICS:
+        lines.append('- {} ({}): {}'.format(metric, METRIC_NAMES[metric], ', '.join('"' + label + '"' for label in LABELS[metric])))
+    return '\n'.join(lines)
+
+def generate_combined_prompt(root, method='base', max_tokens=8000, TEST='vali', testNum=1):
+    """Builds one prompt per vulnerability asking for all four CVSS metrics at once.
+
+    The function and description come from the AV dataset; the ground truth of every
+    metric is collected by id into {'AV': ..., 'AC': ..., 'PR': ..., 'UI': ...}. Only the
+    zero-shot COMBINED_METHODS are supported; others raise ValueError rather than silently
+    running zero-shot under another method's name.
+    """
+    if method not in COMBINED_METHODS:
+        raise ValueError(f"combined cvss prompts support the methods {', '.join(COMBINED_METHODS)}, not {method!r}")
+    suffix = {'test': '-test.json', 'vali': '-probe.json', 'remain': '-remain.json'}[TEST]
+    metric_data = {}
+    for metric in CVSS_METRICS:
+        with open(os.path.join(root, 'cvss', metric + suffix)) as f:
+            metric_data[metric] = json.load(f)[metric]
+
+    system_message = {'role': 'system', 'content': combined_system_prompt()}
+    prompts = []
+    for id in tqdm(metric_data['AV']):
+        if len(prompts) >= testNum:
+            break
+        item = metric_data['AV'][id]
+        if method == 'manual-info':
+            clonze = '\n'.join(['Function: ' + item['function'], item['description']])
+        else:
+            clonze = '\n'.join(['Function: ' + item['function'],
+                                'Function description: ' + item['description']])
+        user_message = {'role': 'user', 'content': clonze}
+        if tokens.num_tokens_from_messages([system_message, user_message]) > max_tokens:
+            print('message processing ({} tokens): {}'.format(max_tokens, id))
+            user_message = tokens.message_process(user_message, max_tokens - tokens.num_tokens_from_messages([system_message]))
+        ground_truth = {metric: metric_data[metric][id]['ground_truth'] if id in metric_data[metric] else None
+                        for metric in CVSS_METRICS}
+        prompts.append({'id': id, 'prompt': [system_message, user_message], 'ground_truth': ground_truth})
+
+    print(len(prompts))
+    return prompts
+
+def combined_response_parser(response):
+    """Adds the parsed per-metric labels of a combined answer as 'metrics'."""
+    try:
+        answer = json.loads(response['choices'][0]['message']['content'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return {'metrics': None}
+    metrics = {}
+    for metric in CVSS_METRICS:
+        value = str(answer.get(metric, '')).strip().lower()
+        # Longest label first so "Adjacent Network" is not read as "Network"
+        matches = [label for label in sorted(LABELS[metric], key=len, reverse=True) if label.lower() == value]
+        metrics[metric] = matches[0] if matches else None
+    return {'metrics': metrics}
+
+def split_combined_results(combined_file, result_file_path, result_file_name):
+    """Splits a combined cvss result file into <result_file_name>_<metric>.json files.
+
+    Each per-metric item keeps the chat-completions shape with the answer rewritten to
+    'Category: <label>'. Token usage is left in the combined file only, so summing the
+    per-metric files does not count the shared request four times.
+    """
+    with open(combined_file) as f:
+        combined = json.load(f)
+
+    split_files = []
+    for metric in CVSS_METRICS:
+        metric_results = []
+        for item in combined:
+            response = item['response']
+            if isinstance(response, dict) and 'choices' in response:
+                label = (item.get('metrics') or {}).get(metric)
+                response = copy.deepcopy(response)
+                response.pop('usage', None)
+                response['choices'] = [{'index': 0, 'message': {'role': 'assistant', 'content': 'Category: ' + str(label)}, 'finish_reason': 'stop'}]
+            metric_results.append({
+                'id': item['id'],
+                'ground_truth': item['ground_truth'][metric],
+                'prompt': item['prompt'],
+                'response': response,
+            })
+        metric_file = os.path.join(result_file_path, result_file_name + '_' + metric + '.json')
+        with open(metric_file, 'w') as f:
+            json.dump(metric_results, f, indent=4)
+        split_files.append(metric_file)
+    return split_files
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import sqlite3
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+class DatasetStream:
+    """Incremental reader of a `{dataset: {id: item}}` JSON file.
+
+    Only the part of the file up to the current item is read, and only one item is decoded
+    at a time, so taking the first few items of a huge split costs as much as those items.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Reads the next chunk; returns False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"expected one of {chars!r} at offset {self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next JSON value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and not isinstance(value, (dict, list, str)):
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yields the key of each member of the object at the cursor; the caller must read its value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+def iter_dataset_items(data_file, dataset):
+    """Yields (id, item) of `dataset` in file order; raises KeyError if the file has no such dataset."""
+    with open(data_file) as f:
+        stream = DatasetStream(f)
+        for name in stream.members():
+            if name != dataset:
+                stream.value()
+                continue
+            for id in stream.members():
+                yield id, stream.value()
+            return
+    raise KeyError(dataset)
+
+# Compiled store: <dataset>-<split>.sqlite next to the JSON file, one row per item with its
+# position in the dataset, indexed by id and by position, read through SQLite's mmap.
+MMAP_SIZE = 1 << 30
+ID_BATCH = 500
+
+def compiled_path(data_file):
+    return os.path.splitext(data_file)[0] + '.sqlite'
+
+def source_stamp(data_file):
+    stat = os.stat(data_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def compile_dataset(data_file):
+    """Compiles a `{dataset: {id: item}}` JSON file into its SQLite store; returns the store path."""
+    store_file = compiled_path(data_file)
+    tmp_file = store_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+    connection.execute('CREATE TABLE items (dataset TEXT, position INTEGER, id TEXT, item TEXT, PRIMARY KEY (dataset, position))')
+    with open(data_file) as f:
+        stream = DatasetStream(f)
+        for dataset in stream.members():
+            rows = ((dataset, position, id, json.dumps(stream.value())) for position, id in enumerate(stream.members()))
+            connection.executemany('INSERT INTO items VALUES (?, ?, ?, ?)', rows)
+    connection.execute('CREATE UNIQUE INDEX items_by_id ON items (dataset, id)')
+    connection.execute('INSERT INTO meta VALUES (?, ?)', ('source_stamp', source_stamp(data_file)))
+    connection.commit()
+    connection.close()
+    os.replace(tmp_file, store_file)
+    return store_file
+
+class DatasetStore:
+    """Random access by id or position to a compiled dataset split."""
+
+    def __init__(self, store_file):
+        self.connection = sqlite3.connect(f"file:{store_file}?mode=ro", uri=True)
+        self.connection.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+
+    def meta(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def has_dataset(self, dataset):
+        return self.connection.execute('SELECT 1 FROM items WHERE dataset = ? LIMIT 1', (dataset,)).fetchone() is not None
+
+    def count(self, dataset):
+        return self.connection.execute('SELECT COUNT(*) FROM items WHERE dataset = ?', (dataset,)).fetchone()[0]
+
+    def get_many(self, dataset, ids):
+        """Returns {id: item} for the given ids, in the order given; unknown ids are left out."""
+        found = {}
+        ids = list(ids)
+        for i in range(0, len(ids), ID_BATCH):
+            batch = ids[i:i + ID_BATCH]
+            query = f"SELECT id, item FROM items WHERE dataset = ? AND id IN ({','.join('?' * len(batch))})"
+            found.update(self.connection.execute(query, (dataset, *batch)))
+        return {id: json.loads(found[id]) for id in ids if id in found}
+
+    def slice(self, dataset, start=0, stop=None):
+        """Returns {id: item} for positions start..stop-1 of the dataset, in file order."""
+        query = 'SELECT id, item FROM items WHERE dataset = ? AND position >= ?'
+        params = [dataset, start]
+        if stop is not None:
+            query += ' AND position < ?'
+            params.append(stop)
+        rows = self.connection.execute(query + ' ORDER BY position', params)
+        return {id: json.loads(item) for id, item in rows}
+
+    def close(self):
+        self.connection.close()
+
+def open_dataset_store(data_file):
+    """Returns the DatasetStore of a JSON split, or None if it was never compiled or is stale."""
+    store_file = compiled_path(data_file)
+    if not os.path.exists(store_file):
+        return None
+    store = DatasetStore(store_file)
+    if store.meta('source_stamp') != source_stamp(data_file):
+        store.close()
+        return None
+    return store
+
+def main():
+    # python -m src.dataset data/<task>/*.json  (directories are compiled file by file)
+    paths = sys.argv[1:] or [os.path.join(os.getcwd(), 'data')]
+    for path in paths:
+        data_files = [path]
+        if os.path.isdir(path):
+            data_files = [os.path.join(directory, name) for directory, _, names in os.walk(path) for name in sorted(names)
+                          if name.endswith(('-test.json', '-probe.json', '-remain.json'))]
+        for data_file in data_files:
+            print(f"Compiled {data_file} -> {compile_dataset(data_file)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import re
+from dataclasses import dataclass, field
+from src import tokens
+
+# Datasets whose prompts embed a raw patch (see prompt.generate_prompt)
+DIFF_DATASETS = {'stable_patchnet', 'APCA_panther', 'APCA_invalidator'}
+
+# Changes to these files say little about the fix itself and are dropped first
+LOW_RELEVANCE_PATTERN = re.compile(r'(^|/)(tests?|testing|docs?|Documentation)/|_test\.|Test\.java|ChangeLog|NEWS|\.(md|rst|txt)$', re.IGNORECASE)
+
+HUNK_HEADER = re.compile(r'^@@ -\d+(,\d+)? \+\d+(,\d+)? @@')
+
+@dataclass
+class Hunk:
+    header: str
+    lines: list = field(default_factory=list)
+    context: int = None  # context lines kept around changes, None for all
+    dropped: bool = False
+
+    @property
+    def num_changes(self):
+        return sum(1 for line in self.lines if line[:1] in ('+', '-'))
+
+    def render(self):
+        if self.dropped:
+            return [self.header + f' [hunk omitted: {self.num_changes} changed lines]']
+        if self.context is None:
+            return [self.header] + self.lines
+        changed = [i for i, line in enumerate(self.lines) if line[:1] in ('+', '-')]
+        near = {i for c in changed for i in range(c - self.context, c + self.context + 1)}
+        rendered = [self.header]
+        last = -1
+        for i, line in enumerate(self.lines):
+            if line[:1] == '\\' or i in near:
+                if last >= 0 and i > last + 1:
+                    rendered.append(' ...')
+                rendered.append(line)
+                last = i
+        return rendered
+
+@dataclass
+class FileDiff:
+    headers: list
+    hunks: list = field(default_factory=list)
+    dropped: bool = False
+
+    @property
+    def path(self):
+        for header in self.headers:
+            if header.startswith('+++ ') or header.startswith('diff --git '):
+                return header.split()[-1]
+        return ''
+
+    @property
+    def weight(self):
+        return 0.1 if LOW_RELEVANCE_PATTERN.search(self.path) else 1
+
+    @property
+    def relevance(self):
+        return sum(hunk.num_changes for hunk in self.hunks) * self.weight
+
+    def render(self):
+        if self.dropped:
+            return self.headers + [f'[file omitted: {len(self.hunks)} hunks]']
+        return self.headers + [line for hunk in self.hunks for line in hunk.render()]
+
+def parse_diff(text):
+    """Splits a unified diff into (preamble lines, [FileDiff]); the preamble is everything before the first file."""
+    preamble = []
+    files = []
+    lines = text.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        plain_file = line.startswith('--- ') and i + 1 < len(lines) and lines[i + 1].startswith('+++ ')
+        if line.startswith('diff --git ') or (plain_file and not (files and not files[-1].hunks)):
+            files.append(FileDiff(headers=[line]))
+        elif files and HUNK_HEADER.match(line):
+            files[-1].hunks.append(Hunk(header=line))
+        elif files and files[-1].hunks and (line[:1] in (' ', '+', '-', '\\') or line == ''):
+            files[-1].hunks[-1].lines.append(line)
+        elif files and not files[-1].hunks:
+            files[-1].headers.append(line)
+        elif files:
+            # Trailing text after the last hunk (e.g. a format-patch signature) stays with that hunk
+            files[-1].hunks[-1].lines.append(line)
+        else:
+            preamble.append(line)
+        i += 1
+    return preamble, files
+
+def render_diff(preamble, files):
+    return '\n'.join(preamble + [line for file in files for line in file.render()])
+
+def reduce_diff(text, max_tokens, model="gpt-4o-mini"):
+    """Shrinks a patch to `max_tokens` tokens while keeping its changed lines as long as possible.
+
+    Context lines are trimmed first (3, 1, then 0 lines around each change), then whole
+    hunks and finally whole files are replaced by one-line placeholders, least relevant
+    first (fewest changed lines; tests, docs and changelogs count for a tenth). The preamble
+    (commit message) and file headers are kept. Text that still does not fit, or that is not
+    a diff, is cut from the end.
+
+    Each hunk and file header is counted once per form it takes and the patch size is kept
+    as a running sum; the patch is only rendered and counted when that sum says it fits.
+    """
+    encoding = tokens.get_encoding(model)
+    if tokens.count_text_tokens(text, encoding) <= max_tokens:
+        return text
+    preamble, files = parse_diff(text)
+    hunks = [hunk for file in files for hunk in file.hunks]
+    if not hunks:
+        return tokens.truncate_text(text, max_tokens, encoding)
+
+    def cost(lines):
+        # A block's own tokens plus the newline joining it to the next block
+        return tokens.count_text_tokens('\n'.join(lines), encoding) + 1 if lines else 0
+
+    hunk_costs = {id(hunk): cost(hunk.render()) for hunk in hunks}
+    total = cost(preamble) + sum(cost(file.headers) for file in files) + sum(hunk_costs.values()) - 1  # no newline after the last block
+    error = 0  # how far the running sum fell short of the rendered size at the last check
+
+    def check():
+        """Returns the rendered patch if it fits, else None."""
+        nonlocal error
+        if total + error > max_tokens:
+            return None
+        rendered = render_diff(preamble, files)
+        size = tokens.count_text_tokens(rendered, encoding)
+        if size <= max_tokens:
+            return rendered
+        error = size - total
+        return None
+
+    def recost(hunk):
+        nonlocal total
+        new_cost = cost(hunk.render())
+        total += new_cost - hunk_costs[id(hunk)]
+        hunk_costs[id(hunk)] = new_cost
+
+    for context in (3, 1, 0):
+        for hunk in hunks:
+            hunk.context = context
+            recost(hunk)
+        rendered = check()
+        if rendered is not None:
+            return rendered
+
+    weighted = [(hunk, file.weight) for file in files for hunk in file.hunks]
+    for hunk, _ in sorted(weighted, key=lambda pair: pair[0].num_changes * pair[1]):
+        hunk.dropped = True
+        recost(hunk)
+        rendered = check()
+        if rendered is not None:
+            return rendered
+
+    for file in sorted(files, key=lambda file: file.relevance):
+        total -= cost(file.headers) + sum(hunk_costs[id(hunk)] for hunk in file.hunks)
+        file.dropped = True
+        total += cost(file.render())
+        rendered = check()
+        if rendered is not None:
+            return rendered
+    return tokens.truncate_text(render_diff(preamble, files), max_tokens, encoding)
@@ -0,0 +1,48 @@
+import re
+
+RATE_LIMIT = 'rate_limit'
+TRANSIENT = 'transient'
+AUTH = 'auth'
+INVALID = 'invalid'
+CONTEXT_LENGTH = 'context_length_exceeded'
+
+# Only these are worth another attempt as-is; context-length errors are retried after truncation
+RETRYABLE = {RATE_LIMIT, TRANSIENT}
+# Failures a sweep with fresh attempts cannot fix: the same request would fail again
+UNSWEEPABLE = {AUTH, INVALID, CONTEXT_LENGTH}
+
+AUTH_CODES = {'invalid_api_key', 'insufficient_quota', 'account_deactivated', 'billing_hard_limit_reached'}
+# Configuration mistakes in the request itself: fail fast as INVALID, not as an auth problem
+INVALID_CODES = {'model_not_found'}
+
+def classify_error(http_status, error):
+    """Classifies a failed attempt from its HTTP status and error body (or exception)."""
+    if isinstance(error, Exception):
+        return TRANSIENT
+    body = error.get('error') if isinstance(error, dict) else None
+    if not isinstance(body, dict):
+        body = {}
+    code = body.get('code') or ''
+    message = body.get('message') or ''
+    if code == CONTEXT_LENGTH or 'maximum context length' in message:
+        return CONTEXT_LENGTH
+    if code in INVALID_CODES:
+        return INVALID
+    if code in AUTH_CODES or http_status in (401, 403):
+        return AUTH
+    if http_status == 429 or code == 'rate_limit_exceeded' or 'Rate limit' in message:
+        return RATE_LIMIT
+    if http_status is None or http_status >= 500 or http_status in (408, 409):
+        return TRANSIENT
+    if 400 <= http_status < 500:
+        return INVALID
+    return TRANSIENT
+
+def context_overflow(error):
+    """Returns (context limit, requested tokens) parsed from a context-length error, or None."""
+    message = ((error.get('error') or {}).get('message') or '') if isinstance(error, dict) else ''
+    limit = re.search(r'maximum context length is (\d+) tokens', message)
+    requested = re.search(r'(?:resulted in|requested) (\d+) tokens', message)
+    if not limit or not requested:
+        return None
+    return int(limit.group(1)), int(requested.group(1))
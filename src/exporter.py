@@ -0,0 +1,68 @@
+import time
+from aiohttp import web
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def render_metrics(status_tracker, labels=None):
+    """Renders a StatusTracker in the Prometheus text exposition format."""
+    label_text = format_labels(labels)
+    lines = []
+
+    def metric(name, kind, help_text, value):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name}{label_text} {value}')
+
+    metric('llm_requests_in_flight', 'gauge', 'HTTP requests currently awaiting a response.', status_tracker.num_requests_in_flight)
+    metric('llm_tasks_in_progress', 'gauge', 'Items started but not finished (in flight or queued for retry).', status_tracker.num_tasks_in_progress)
+    metric('llm_tasks_started_total', 'counter', 'Items started.', status_tracker.num_tasks_started)
+    metric('llm_tasks_succeeded_total', 'counter', 'Items finished with a response.', status_tracker.num_tasks_succeeded)
+    metric('llm_tasks_failed_total', 'counter', 'Items that ran out of attempts (including ones later swept).', status_tracker.num_tasks_failed)
+    metric('llm_items_swept_total', 'counter', 'Failed items re-queued by the end-of-run sweep.', status_tracker.num_items_swept)
+    metric('llm_items_recovered_total', 'counter', 'Swept items that then succeeded.', status_tracker.num_items_recovered)
+    metric('llm_attempts_total', 'counter', 'HTTP requests dispatched, including retries.', status_tracker.num_attempts)
+    metric('llm_rate_limit_errors_total', 'counter', 'Responses rejected by the provider rate limit.', status_tracker.num_rate_limit_errors)
+    metric('llm_api_errors_total', 'counter', 'Other error responses from the API.', status_tracker.num_api_errors)
+    metric('llm_other_errors_total', 'counter', 'Connection and client-side errors.', status_tracker.num_other_errors)
+    metric('llm_request_bucket_available', 'gauge', 'Available request capacity of the RPM bucket.', status_tracker.available_request_capacity)
+    metric('llm_token_bucket_available', 'gauge', 'Available token capacity of the TPM bucket.', status_tracker.available_token_capacity)
+    metric('llm_prompt_tokens_total', 'counter', 'Prompt tokens reported in response usage.', status_tracker.prompt_tokens_used)
+    metric('llm_completion_tokens_total', 'counter', 'Completion tokens reported in response usage.', status_tracker.completion_tokens_used)
+    metric('llm_checkpoint_lag_items', 'gauge', 'Finished items not yet written to the results file.', status_tracker.num_results_unsaved)
+    if status_tracker.circuit_breaker:
+        breaker_state = {'closed': 0, 'half_open': 1, 'open': 2}[status_tracker.circuit_breaker.state]
+        metric('llm_circuit_breaker_state', 'gauge', 'Circuit breaker state (0 closed, 1 half-open, 2 open).', breaker_state)
+        metric('llm_attempts_refunded_total', 'counter', 'Attempts given back because they failed during an outage.', status_tracker.num_attempts_refunded)
+    if status_tracker.ordered_writer:
+        metric('llm_reorder_buffer_items', 'gauge', 'Finished results waiting in the reorder buffer.', len(status_tracker.ordered_writer.buffer))
+    metric('llm_checkpoint_blocked_seconds_total', 'counter', 'Seconds the dispatch loop spent blocked on checkpoints.', status_tracker.checkpoint_blocked_seconds)
+    metric('llm_checkpoint_lag_seconds', 'gauge', 'Seconds since the results file was last written.', time.time() - status_tracker.time_of_last_checkpoint)
+
+    render_histogram(lines, 'llm_request_latency_seconds', 'Latency of one HTTP attempt.', status_tracker.request_latency, labels)
+    for key, histograms in status_tracker.latency_histograms.items():
+        for phase, histogram in histograms.items():
+            render_histogram(lines, f'llm_{phase}_latency_seconds', f'Per task/model {phase} latency.', histogram, {**(labels or {}), 'key': key})
+    return '\n'.join(lines) + '\n'
+
+def render_histogram(lines, name, help_text, histogram, labels=None):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for bound, running in histogram.cumulative_counts():
+        lines.append(f'{name}_bucket{format_labels({**(labels or {}), "le": bound})} {running}')
+    lines.append(f'{name}_sum{format_labels(labels)} {histogram.total}')
+    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+async def start_metrics_exporter(status_tracker, port, host='127.0.0.1', labels=None):
+    """Serves GET /metrics for the running dispatcher; returns the AppRunner to clean up."""
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(status_tracker, labels), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
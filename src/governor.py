@@ -0,0 +1,115 @@
+import time
+from dataclasses import dataclass, field
+
+# USD per 1M tokens: (input, output)
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+def get_model_prices(model):
+    """Returns (input, output) USD prices per 1M tokens, matching the longest known model prefix."""
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return MODEL_PRICES['gpt-4o-mini']
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Returns the estimated USD cost of the given token usage."""
+    input_price, output_price = get_model_prices(model)
+    return (prompt_tokens / 1_000_000) * input_price + (completion_tokens / 1_000_000) * output_price
+
+@dataclass
+class RunGovernor:
+    """Tracks live spend of a run and enforces an optional cost cap and finish-by deadline.
+
+    The dispatcher asks `allow` before every dispatch. Near the cost cap this throttles
+    dispatch so the in-flight requests cannot overshoot it; once the cap or the deadline
+    is reached `stop_reason` is set and the dispatcher drains and writes a resume manifest.
+    """
+    model: str
+    max_cost: float = None          # USD, None for no cap
+    deadline: float = None          # epoch seconds, None for no deadline
+    max_requests_per_minute: float = None
+    max_tokens_per_minute: float = None
+    expected_completion_tokens: int = 50  # prior until real usage is observed
+    remaining_prompt_tokens: int = 0
+    remaining_items: int = 0
+    start_time: float = field(default_factory=time.time)
+    stop_reason: str = None
+
+    def avg_completion_tokens(self, status_tracker):
+        if status_tracker.num_tasks_succeeded == 0:
+            return self.expected_completion_tokens
+        return status_tracker.completion_tokens_used / status_tracker.num_tasks_succeeded
+
+    def spent(self, status_tracker):
+        return estimate_cost(self.model, status_tracker.prompt_tokens_used, status_tracker.completion_tokens_used)
+
+    def request_cost(self, status_tracker, prompt_tokens):
+        return estimate_cost(self.model, prompt_tokens, self.avg_completion_tokens(status_tracker))
+
+    def projected_cost(self, status_tracker):
+        """Spent so far plus the expected cost of every item not yet finished."""
+        avg_completion = self.avg_completion_tokens(status_tracker)
+        avg_prompt = self.remaining_prompt_tokens / self.remaining_items if self.remaining_items else 0
+        pending_items = self.remaining_items + status_tracker.num_tasks_in_progress
+        pending_prompt = self.remaining_prompt_tokens + status_tracker.num_tasks_in_progress * avg_prompt
+        return self.spent(status_tracker) + estimate_cost(self.model, pending_prompt, pending_items * avg_completion)
+
+    def eta_seconds(self, status_tracker):
+        """Seconds until the run finishes, from observed throughput or the configured rate limits."""
+        pending_items = self.remaining_items + status_tracker.num_tasks_in_progress
+        limit_minutes = 0
+        if self.max_requests_per_minute:
+            limit_minutes = max(limit_minutes, pending_items / self.max_requests_per_minute)
+        if self.max_tokens_per_minute:
+            limit_minutes = max(limit_minutes, self.remaining_prompt_tokens / self.max_tokens_per_minute)
+        # Swept items were counted as failed and are being retried
+        finished = status_tracker.num_tasks_succeeded + status_tracker.num_tasks_failed - status_tracker.num_items_swept
+        elapsed = time.time() - self.start_time
+        if finished >= 10 and elapsed > 0:
+            return max(pending_items / (finished / elapsed), limit_minutes * 60)
+        return limit_minutes * 60
+
+    def on_dispatch(self, prompt_tokens, new_item):
+        if new_item:
+            self.remaining_items -= 1
+            self.remaining_prompt_tokens = max(self.remaining_prompt_tokens - prompt_tokens, 0)
+
+    def allow(self, status_tracker, prompt_tokens):
+        """Returns True if a request of `prompt_tokens` may be dispatched now."""
+        if self.stop_reason:
+            return False
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.stop_reason = 'deadline reached'
+            return False
+        if self.max_cost is None:
+            return True
+        spent = self.spent(status_tracker)
+        if spent >= self.max_cost:
+            self.stop_reason = f'cost cap reached (${spent:.4f} of ${self.max_cost:.4f})'
+            return False
+        # Reserve the expected cost of the requests already in flight before adding another one.
+        # num_requests_in_flight excludes the candidate (and requests waiting for a retry), which
+        # num_tasks_in_progress does not.
+        avg_prompt = self.remaining_prompt_tokens / self.remaining_items if self.remaining_items else prompt_tokens
+        in_flight_cost = status_tracker.num_requests_in_flight * self.request_cost(status_tracker, avg_prompt)
+        if spent + in_flight_cost + self.request_cost(status_tracker, prompt_tokens) > self.max_cost:
+            if status_tracker.num_requests_in_flight == 0:
+                # Nothing in flight can free up budget: the next request can never fit
+                self.stop_reason = f'cost cap reached (${spent:.4f} of ${self.max_cost:.4f})'
+            return False
+        return True
+
+    def summary(self, status_tracker):
+        eta = self.eta_seconds(status_tracker)
+        text = f"spent ${self.spent(status_tracker):.4f}, projected ${self.projected_cost(status_tracker):.4f}, ETA {eta/60:.1f} min"
+        if self.max_cost is not None:
+            text += f", cap ${self.max_cost:.4f}"
+        if self.deadline is not None:
+            text += f", deadline in {(self.deadline - time.time())/60:.1f} min"
+        return text
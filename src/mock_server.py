@@ -0,0 +1,179 @@
+import math
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from aiohttp import web
+
+@dataclass
+class MockServerConfig:
+    """Behaviour of the mock chat-completions endpoint."""
+    latency: str = 'lognormal'       # constant | uniform | lognormal
+    latency_mean: float = 0.8        # seconds
+    latency_sigma: float = 0.5       # lognormal sigma, or +- spread for uniform
+    error_rate_5xx: float = 0.0      # probability of a 500/502/503 response
+    max_requests_per_minute: float = None  # server-side limits, 429 when exceeded
+    max_tokens_per_minute: float = None
+    completion_tokens: int = 20
+    seed: int = 0
+
+@dataclass
+class MockServerStats:
+    num_requests: int = 0
+    num_succeeded: int = 0
+    num_rate_limited: int = 0
+    num_server_errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latencies: list = field(default_factory=list)
+    arrival_times: list = field(default_factory=list)  # one per request, including rejected ones
+    start_time: float = field(default_factory=time.time)
+
+class MockChatServer:
+    """aiohttp mock of POST /v1/chat/completions with latency, 429/5xx injection and usage.
+
+    Prompt tokens are approximated as characters/4 so the server stays cheap at high RPM.
+    GET /stats returns the counters and latency percentiles seen by the server.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or MockServerConfig()
+        self.stats = MockServerStats()
+        self.random = random.Random(self.config.seed)
+        self.request_capacity = self.config.max_requests_per_minute
+        self.token_capacity = self.config.max_tokens_per_minute
+        self.last_update_time = time.time()
+
+    def sample_latency(self):
+        config = self.config
+        if config.latency == 'constant':
+            return config.latency_mean
+        if config.latency == 'uniform':
+            return max(0.0, self.random.uniform(config.latency_mean - config.latency_sigma, config.latency_mean + config.latency_sigma))
+        if config.latency_mean <= 0:
+            return 0.0
+        # lognormal with the requested mean
+        mu = math.log(config.latency_mean) - config.latency_sigma ** 2 / 2
+        return self.random.lognormvariate(mu, config.latency_sigma)
+
+    def refill(self):
+        now = time.time()
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        if self.config.max_requests_per_minute:
+            self.request_capacity = min(self.request_capacity + self.config.max_requests_per_minute * elapsed / 60.0, self.config.max_requests_per_minute)
+        if self.config.max_tokens_per_minute:
+            self.token_capacity = min(self.token_capacity + self.config.max_tokens_per_minute * elapsed / 60.0, self.config.max_tokens_per_minute)
+
+    def rate_limit_headers(self):
+        headers = {}
+        if self.config.max_requests_per_minute:
+            headers['x-ratelimit-limit-requests'] = str(int(self.config.max_requests_per_minute))
+            headers['x-ratelimit-remaining-requests'] = str(max(int(self.request_capacity), 0))
+        if self.config.max_tokens_per_minute:
+            headers['x-ratelimit-limit-tokens'] = str(int(self.config.max_tokens_per_minute))
+            headers['x-ratelimit-remaining-tokens'] = str(max(int(self.token_capacity), 0))
+        return headers
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.stats.num_requests += 1
+        start = time.time()
+        self.stats.arrival_times.append(start)
+        n = body.get('n', 1)
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4 + 3
+        completion_tokens = min(self.config.completion_tokens, body.get('max_tokens') or self.config.completion_tokens)
+
+        self.refill()
+        reserved_tokens = prompt_tokens + completion_tokens * n
+        if (self.config.max_requests_per_minute and self.request_capacity < 1) or \
+           (self.config.max_tokens_per_minute and self.token_capacity < reserved_tokens):
+            self.stats.num_rate_limited += 1
+            return web.json_response(
+                {'error': {'message': 'Rate limit reached for requests (mock server)', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                status=429, headers=self.rate_limit_headers())
+        if self.config.max_requests_per_minute:
+            self.request_capacity -= 1
+        if self.config.max_tokens_per_minute:
+            self.token_capacity -= reserved_tokens
+
+        await asyncio.sleep(self.sample_latency())
+
+        if self.random.random() < self.config.error_rate_5xx:
+            self.stats.num_server_errors += 1
+            status = self.random.choice([500, 502, 503])
+            return web.json_response(
+                {'error': {'message': f'The server had an error while processing your request (mock {status})', 'type': 'server_error'}},
+                status=status, headers=self.rate_limit_headers())
+
+        self.stats.num_succeeded += 1
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.completion_tokens += completion_tokens * n
+        self.stats.latencies.append(time.time() - start)
+        response = {
+            'id': f'chatcmpl-mock-{self.stats.num_requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{'index': i, 'message': {'role': 'assistant', 'content': 'Category: mock'}, 'finish_reason': 'stop'} for i in range(n)],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens * n, 'total_tokens': prompt_tokens + completion_tokens * n},
+        }
+        return web.json_response(response, headers=self.rate_limit_headers())
+
+    async def stats_handler(self, request):
+        return web.json_response(self.summary())
+
+    def summary(self):
+        stats = self.stats
+        latencies = sorted(stats.latencies)
+        return {
+            'num_requests': stats.num_requests,
+            'num_succeeded': stats.num_succeeded,
+            'num_rate_limited': stats.num_rate_limited,
+            'num_server_errors': stats.num_server_errors,
+            'prompt_tokens': stats.prompt_tokens,
+            'completion_tokens': stats.completion_tokens,
+            'latency_percentiles': latency_percentiles(latencies),
+            'uptime': time.time() - stats.start_time,
+        }
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        app.router.add_get('/stats', self.stats_handler)
+        return app
+
+def latency_percentiles(sorted_latencies, percentiles=(50, 90, 95, 99)):
+    """Returns {'p50': seconds, ...} of an ascending list of latencies."""
+    if not sorted_latencies:
+        return {}
+    return {f'p{p}': sorted_latencies[min(int(len(sorted_latencies) * p / 100), len(sorted_latencies) - 1)] for p in percentiles}
+
+async def start_mock_server(server, host='127.0.0.1', port=8080):
+    """Starts the mock server in the running event loop; returns the AppRunner to clean up."""
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI chat-completions server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', default='lognormal', choices=['constant', 'uniform', 'lognormal'])
+    parser.add_argument('--latency-mean', type=float, default=0.8)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=float, default=None)
+    parser.add_argument('--tpm', type=float, default=None)
+    args = parser.parse_args()
+
+    config = MockServerConfig(latency=args.latency, latency_mean=args.latency_mean, latency_sigma=args.latency_sigma,
+                              error_rate_5xx=args.error_rate, max_requests_per_minute=args.rpm, max_tokens_per_minute=args.tpm)
+    server = MockChatServer(config)
+    print(f"Mock chat-completions server on http://{args.host}:{args.port}/v1/chat/completions")
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None)
+
+if __name__ == '__main__':
+    main()
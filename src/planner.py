@@ -0,0 +1,112 @@
+import heapq
+from src import tokens
+from src.governor import estimate_cost
+
+RPM = 'RPM'
+TPM = 'TPM'
+CONCURRENCY = 'concurrency'
+
+def simulate_schedule(token_consumptions, max_requests_per_minute, max_tokens_per_minute, latency=1.0, max_concurrent_requests=None):
+    """Replays the dispatcher's token-bucket schedule without sending anything.
+
+    Both buckets start full and refill continuously, as in async_api_requests. Each request
+    is dispatched at the earliest time the request bucket, the token bucket and the
+    concurrency limit all allow it, and completes `latency` seconds later. Returns the
+    wall-clock duration and the seconds of waiting attributed to each limit.
+    """
+    request_rate = max_requests_per_minute / 60.0
+    token_rate = max_tokens_per_minute / 60.0
+    request_capacity = max_requests_per_minute
+    token_capacity = max_tokens_per_minute
+    now = 0.0
+    completions = []
+    waited = {RPM: 0.0, TPM: 0.0, CONCURRENCY: 0.0}
+    too_large = 0
+
+    for consumption in token_consumptions:
+        if consumption > max_tokens_per_minute:
+            # The live dispatcher would wait forever for this one; leave it out of the plan
+            too_large += 1
+            continue
+        start = now
+        if max_concurrent_requests and len(completions) >= max_concurrent_requests:
+            start = max(start, heapq.heappop(completions))
+            waited[CONCURRENCY] += start - now
+        elapsed = start - now
+        request_capacity = min(request_capacity + elapsed * request_rate, max_requests_per_minute)
+        token_capacity = min(token_capacity + elapsed * token_rate, max_tokens_per_minute)
+        request_wait = max(1 - request_capacity, 0) / request_rate
+        token_wait = max(consumption - token_capacity, 0) / token_rate
+        wait = max(request_wait, token_wait)
+        if wait > 0:
+            waited[RPM if request_wait >= token_wait else TPM] += wait
+            request_capacity = min(request_capacity + wait * request_rate, max_requests_per_minute)
+            token_capacity = min(token_capacity + wait * token_rate, max_tokens_per_minute)
+        now = start + wait
+        request_capacity -= 1
+        token_capacity -= consumption
+        heapq.heappush(completions, now + latency)
+        while max_concurrent_requests is None and completions and completions[0] <= now:
+            heapq.heappop(completions)
+
+    duration = max(completions) if completions else now
+    return {'duration': duration, 'waited': waited, 'too_large': too_large}
+
+def best_concurrency(token_consumptions, max_requests_per_minute, max_tokens_per_minute, latency=1.0, tolerance=0.02):
+    """Returns the smallest concurrency limit whose duration is within `tolerance` of unlimited."""
+    unlimited = simulate_schedule(token_consumptions, max_requests_per_minute, max_tokens_per_minute, latency)['duration']
+    concurrency = 1
+    while concurrency < len(token_consumptions):
+        duration = simulate_schedule(token_consumptions, max_requests_per_minute, max_tokens_per_minute, latency, concurrency)['duration']
+        if duration <= unlimited * (1 + tolerance):
+            return concurrency
+        concurrency *= 2
+    return max(len(token_consumptions), 1)
+
+def plan_run(prompts, model, max_requests_per_minute, max_tokens_per_minute, max_completion_tokens=0, choices=1,
+             expected_completion_tokens=50, latency=1.0, max_concurrent_requests=None):
+    """Dry-run plan of a run: projected cost, wall-clock time and the binding rate limit."""
+    prompt_tokens = [item['prompt_tokens'] if 'prompt_tokens' in item else None for item in prompts]
+    uncounted = [item['prompt'] for item, count in zip(prompts, prompt_tokens) if count is None]
+    counted = iter(tokens.num_tokens_batch(uncounted, model))
+    prompt_tokens = [count if count is not None else next(counted) for count in prompt_tokens]
+    # Same TPM charge as the dispatcher: prompt plus the completion reservation of all choices
+    consumptions = [count + max_completion_tokens * choices for count in prompt_tokens]
+
+    schedule = simulate_schedule(consumptions, max_requests_per_minute, max_tokens_per_minute, latency, max_concurrent_requests)
+    waited = schedule['waited']
+    binding = max(waited, key=waited.get) if any(waited.values()) else None
+    return {
+        'items': len(prompts),
+        'prompt_tokens': sum(prompt_tokens),
+        'estimated_completion_tokens': expected_completion_tokens * choices * len(prompts),
+        'completion_cap': max_completion_tokens,
+        'estimated_cost': estimate_cost(model, sum(prompt_tokens), expected_completion_tokens * choices * len(prompts)),
+        'duration_seconds': schedule['duration'],
+        'binding_limit': binding,
+        'waited_seconds': waited,
+        'too_large': schedule['too_large'],
+        'best_concurrency': best_concurrency(consumptions, max_requests_per_minute, max_tokens_per_minute, latency),
+    }
+
+def format_plan(plan, model, max_requests_per_minute, max_tokens_per_minute):
+    minutes = plan['duration_seconds'] / 60
+    waited = ', '.join(f"{limit} {seconds:.0f}s" for limit, seconds in plan['waited_seconds'].items())
+    lines = [
+        "="*55,
+        f"DRY RUN PLAN ({model}, {max_requests_per_minute} RPM, {max_tokens_per_minute} TPM)",
+        "-"*55,
+        f"Items:                {plan['items']:,}",
+        f"Prompt Tokens:        {plan['prompt_tokens']:,}",
+        f"Est. Completion:      {plan['estimated_completion_tokens']:,}",
+        f"Completion Cap:       {plan['completion_cap'] or 'none'} per choice (reserved against TPM)",
+        f"Projected Cost:       ${plan['estimated_cost']:.4f} (USD)",
+        f"Projected Wall Time:  {minutes:.1f} min",
+        f"Binding Limit:        {plan['binding_limit'] or 'none (latency bound)'}",
+        f"Time Waiting On:      {waited}",
+        f"Best Concurrency:     {plan['best_concurrency']}",
+    ]
+    if plan['too_large']:
+        lines.append(f"WARNING: {plan['too_large']} items need more tokens than the TPM limit and would never be sent")
+    lines.append("="*55)
+    return '\n'.join(lines)
@@ -0,0 +1,66 @@
+import numpy as np
+from src import tokens
+
+# Answer labels of the classification datasets, in ground-truth index order where the
+# ground truth is an index (see the nshot handling in prompt.generate_prompt)
+LABELS = {
+    'Chromium': ["non-security bug report", "security bug report"],
+    'AV': ["Not Related", "Network", "Adjacent Network", "Physical"],
+    'AC': ["Not High", "High"],
+    'PR': ["Not High", "High"],
+    'UI': ["Not Required", "Required"],
+    'stable_patchnet': ["ACK", "NAK"],
+    'APCA_quatrain': ["CoF", "NCF"],
+    'APCA_panther': ["CoF", "NCF"],
+    'APCA_invalidator': ["CoF", "NCF"],
+}
+
+# Extra chat-completions parameters per task. Label tasks answer with a single line
+# ("Category: <label>") under the zero-shot methods in SINGLE_LINE_METHODS, so the
+# completion is capped and cut at the first newline. The other methods (shots,
+# prompt-eng, info-gpt) may reason before answering and are sent unconstrained.
+REQUEST_PROFILES = {
+    'title': {'stop': ["\n"]},
+    'SBRP': {'stop': ["\n"]},
+    'cvss': {'stop': ["\n"]},
+    'APCA': {'stop': ["\n"]},
+    'stable': {'stop': ["\n"]},
+    'vulfix': {},
+}
+
+SINGLE_LINE_METHODS = {'base', 'info-manual', 'manual-info'}
+
+# Tokens allowed on top of the longest "Category: <label>" answer
+LABEL_SLACK_TOKENS = 4
+
+def label_max_tokens(labels, model="gpt-4o-mini"):
+    """Returns a completion cap that fits the longest 'Category: <label>' answer."""
+    return max(tokens.num_tokens_from_text('Category: ' + label, model) for label in labels) + LABEL_SLACK_TOKENS
+
+def label_answer_tokens(labels, model="gpt-4o-mini"):
+    """Returns the mean token length of a 'Category: <label>' answer (an expectation, not a cap)."""
+    return round(sum(tokens.num_tokens_from_text('Category: ' + label, model) for label in labels) / len(labels))
+
+def title_max_tokens(data, model="gpt-4o-mini", percentile=99, margin=1.5):
+    """Returns a completion cap from the token length distribution of the ground-truth titles."""
+    lengths = [tokens.num_tokens_from_text(item['ground_truth'], model) for item in data if item.get('ground_truth')]
+    if not lengths:
+        return None
+    return int(np.ceil(np.percentile(lengths, percentile) * margin))
+
+def get_request_profile(task, dataset, method='base', data=None, model="gpt-4o-mini"):
+    """Returns the extra request parameters (max_tokens, stop, logit_bias) for a task/dataset."""
+    profile = dict(REQUEST_PROFILES.get(task, {}))
+    if method == 'summary':
+        # The summary method asks for free text over the n-shot examples
+        return {}
+    if task != 'title' and method not in SINGLE_LINE_METHODS:
+        # A stop at the first newline or a label-sized cap would cut off the answer
+        return {}
+    if dataset in LABELS:
+        profile['max_tokens'] = label_max_tokens(LABELS[dataset], model)
+    elif task == 'title' and data:
+        max_tokens = title_max_tokens(data, model)
+        if max_tokens:
+            profile['max_tokens'] = max_tokens
+    return profile
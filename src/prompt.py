@@ -1,34 +1,74 @@
 import os
 import json
 from src import tokens
+from src import token_index
+from src import compress
+from src import diffreduce
 import random
+import itertools
 from tqdm import tqdm
+from src.dataset import iter_dataset_items, open_dataset_store
 
-def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali', testNum = 1):
+def data_file_path(root, task, dataset, TEST):
     if TEST=='test':
-        data_file = os.path.join(root, task, dataset+'-test.json')
+        return os.path.join(root, task, dataset+'-test.json')
     elif TEST=='vali':
-        data_file = os.path.join(root, task, dataset+'-probe.json')
+        return os.path.join(root, task, dataset+'-probe.json')
     elif TEST=='remain':
-        data_file = os.path.join(root, task, dataset+'-remain.json')
-    else:
-        print('please input the right TEST!')
-        exit()
-    
+        return os.path.join(root, task, dataset+'-remain.json')
+    return None
+
+def prompt_file_path(root, task, dataset):
     prompt_file = os.path.join(root, task, dataset+'-prompt.json')
     if not os.path.exists(prompt_file):
         prompt_file = os.path.join(root, task, task+'-prompt.json')
+    return prompt_file
+
+def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali', testNum = 1, token_model = None,
+                    compress_context = False, drop_stopwords = False, ids = None, start = 0, truncation = tokens.TRUNCATE_HEAD):
+    # truncation: how oversize content is cut, tokens.TRUNCATE_HEAD / TRUNCATE_TAIL / TRUNCATE_HEAD_TAIL
+    # ids / start: only these item ids, or the items from position `start` on (testNum still caps the count);
+    #              served from the compiled store (python -m src.dataset) when it is up to date
+    # token_model: attach 'prompt_tokens' from an up-to-date token index built for this model's encoding
+    # compress_context: dedupe frames/log lines and strip boilerplate of bug reports before truncation
+    #                   (drop_stopwords also removes nltk stopwords); items get a 'tokens_saved' count
+    data_file = data_file_path(root, task, dataset, TEST)
+    if data_file is None:
+        print('please input the right TEST!')
+        exit()
+    
+    prompt_file = prompt_file_path(root, task, dataset)
     with open(prompt_file) as f:
         prompt = json.load(f)
 
-    with open(data_file) as f:
-        data = json.load(f)
-
-    if dataset in data:
-        data = data[dataset]
+    store = open_dataset_store(data_file)
+    if store is not None:
+        if not store.has_dataset(dataset):
+            print('illegal dataset!')
+            exit()
+        if ids is not None:
+            data = store.get_many(dataset, ids[:testNum])
+        else:
+            data = store.slice(dataset, start, start+testNum)
+        store.close()
     else:
-        print('illegal dataset!')
-        exit()
+        # Stream only the items needed instead of loading the whole split
+        try:
+            items = iter_dataset_items(data_file, dataset)
+            if ids is not None:
+                wanted = set(ids[:testNum])
+                found = {}
+                for id, item in items:
+                    if len(found) == len(wanted):
+                        break
+                    if id in wanted:
+                        found[id] = item
+                data = {id: found[id] for id in ids[:testNum] if id in found}
+            else:
+                data = dict(itertools.islice(items, start, start+testNum))
+        except KeyError:
+            print('illegal dataset!')
+            exit()
     
     if method in prompt:
         prompt = prompt[method]
@@ -37,15 +77,25 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
         print(prompt.keys())
         exit()
     
+    stopwords_process = compress.nltk_stopwords_process() if compress_context and drop_stopwords else None
+    def compact(text):
+        nonlocal tokens_saved
+        if not compress_context:
+            return text
+        text, saved = compress.compress_field(text, stopwords_process)
+        tokens_saved += saved
+        return text
+
     prompts = []
     prompt_item_num = 0
     for id in tqdm(data):
         if prompt_item_num>=testNum:
             break
         prompt_item = prompt[:-1]
+        tokens_saved = 0
         
         if dataset=='title_itape':
-            clonze = data[id]['bug_report']
+            clonze = compact(data[id]['bug_report'])
             if method=='summary':
                 nshot_file = os.path.join(root, task, dataset+'-nshot.json')
                 with open(nshot_file) as f:
@@ -83,7 +133,7 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
                 prompts.append({'id':id, 'prompt':prompt_item, 'ground_truth': ground_truth})
                 break
             else:
-                clonze = data[id]['bug_report']
+                clonze = compact(data[id]['bug_report'])
         
         elif dataset=='stable_patchnet':
             if method=='summary':
@@ -113,11 +163,11 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
         
         elif dataset=='APCA_quatrain':
             if method=='info-manual':
-                bug_description = data[id]['bug_description']
+                bug_description = compact(data[id]['bug_description'])
                 token_test_message = {'role':'user', 'content':bug_description}        
                 if tokens.num_tokens_from_messages([token_test_message])>max_tokens//2:
                     print('bug report processing ({} tokens): {}'.format(max_tokens//2, id))
-                    bug_description = tokens.message_process(token_test_message, max_tokens//2)['content']
+                    bug_description = tokens.message_process(token_test_message, max_tokens//2, strategy=truncation)['content']
                 clonze = '\n'.join([
                     'Bug report: ', 
                     data[id]['bug_summary'], 
@@ -127,12 +177,12 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
                     # data[id]['patch_code']
                     ])
             elif method=='info-gpt':
-                bug_description = data[id]['bug_description']
+                bug_description = compact(data[id]['bug_description'])
                 patch_description = data[id]['patch_description']
                 token_test_message = {'role':'user', 'content':bug_description}        
                 if tokens.num_tokens_from_messages([token_test_message])>max_tokens//2:
                     print('bug report processing ({} tokens): {}'.format(max_tokens//2, id))
-                    bug_description = tokens.message_process(token_test_message, max_tokens//2)['content']
+                    bug_description = tokens.message_process(token_test_message, max_tokens//2, strategy=truncation)['content']
                 clonze = '\n'.join([
                     'Bug report: ', 
                     data[id]['bug_summary'], 
@@ -142,12 +192,12 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
                     # data[id]['patch_code']
                     ])
             elif method=='info-code':
-                bug_description = data[id]['bug_description']
+                bug_description = compact(data[id]['bug_description'])
                 patch_description = data[id]['patch_description_gpt']
                 token_test_message = {'role':'user', 'content':bug_description}        
                 if tokens.num_tokens_from_messages([token_test_message])>max_tokens//2:
                     print('bug report processing ({} tokens): {}'.format(max_tokens//2, id))
-                    bug_description = tokens.message_process(token_test_message, max_tokens//2)['content']
+                    bug_description = tokens.message_process(token_test_message, max_tokens//2, strategy=truncation)['content']
                 clonze = '\n'.join([
                     'Bug report: ', 
                     data[id]['bug_summary'], 
@@ -185,7 +235,7 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
             else:
                 clonze = '\n'.join([
                     'Bug report: '+ data[id]['bug_summary'], 
-                    data[id]['bug_description'],
+                    compact(data[id]['bug_description']),
                     'Patch: ' + data[id]['patch_description']])
         elif dataset=='APCA_panther':
             if method=='summary':
@@ -289,11 +339,34 @@ def generate_prompt(root, task, dataset, method, max_tokens = 8000, TEST = 'vali
         prompt_user_2 = {'role':'user', 'content':prompt_user_2_content}        
         if tokens.num_tokens_from_messages([prompt_user_2])>max_tokens:
             print('message processing ({} tokens): {}'.format(max_tokens, id))
+            # Only the item content is cut, so the template's instructions survive tail/head_tail;
+            # message_process keeps the 9 token overhead/buffer out of the budget
+            template_tokens = tokens.num_tokens_from_text(prompt_user_2_content) - tokens.num_tokens_from_text(clonze)
+            if dataset in diffreduce.DIFF_DATASETS:
+                # Trim diff context, then whole hunks/files, instead of cutting the patch off mid-way
+                clonze = diffreduce.reduce_diff(clonze, max_tokens - 9 - template_tokens)
+            else:
+                clonze = tokens.message_process({'role':'user', 'content':clonze}, max_tokens - template_tokens, strategy=truncation)['content']
+            prompt_user_2 = {'role':'user', 'content':prompt[-1]['content'].format(clonze)}
+            # Token merges at the template boundary can leave a token or two over the budget
             prompt_user_2 = tokens.message_process(prompt_user_2, max_tokens)
         prompt_item.append(prompt_user_2)
 
         prompts.append({'id':id, 'prompt':prompt_item, 'ground_truth': ground_truth})
+        if compress_context:
+            prompts[-1]['tokens_saved'] = tokens_saved
         prompt_item_num += 1
 
+    if compress_context:
+        print('context compression saved {} tokens over {} items'.format(sum(item.get('tokens_saved', 0) for item in prompts), len(prompts)))
+    # The index is built from uncompressed, head-truncated prompts
+    if token_model and not compress_context and truncation == tokens.TRUNCATE_HEAD:
+        index = token_index.load_token_index(root, task, dataset, TEST, max_tokens, token_model)
+        if index is not None and method in index.methods:
+            for item in prompts:
+                count = index.get(method, item['id'])
+                if count is not None:
+                    item['prompt_tokens'] = count
+
     print(len(prompts))
     return prompts
\ No newline at end of file
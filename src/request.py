@@ -1,17 +1,28 @@
 import os
 import json
+import math
 import time
 import openai
 import logging
 import aiohttp
 import asyncio
+import signal
 from dataclasses import dataclass, field
 import shutil
 from tqdm import tqdm
-from src.tokens import num_tokens_from_messages
+from src.tokens import num_tokens_from_messages, num_tokens_batch, message_process, TRUNCATE_HEAD
+from src import errors
+from src.stats import LatencyHistogram
+from src.exporter import start_metrics_exporter
+from src import trace
+from src.writer import CheckpointWriter, OrderedWriter
+from src.breaker import CLOSED
 
 logger = logging.getLogger(__name__)
 
+# Tokens kept free below the context limit when re-truncating after a context-length error
+CONTEXT_TRUNCATION_MARGIN = 16
+
 async def async_api_requests(
     max_requests_per_minute: float,
     max_tokens_per_minute: float,
@@ -31,6 +42,22 @@ async def async_api_requests(
     temperature: float = 0,
     choices: int = 1,
     data = None, 
+    governor = None,
+    request_profile = None,
+    response_parser = None,
+    metrics_port = None,
+    metrics_host = '127.0.0.1',
+    trace_attempts = False,
+    tracer = None,
+    circuit_breaker = None,
+    max_concurrent_requests = None,
+    sweep_passes = 0,
+    sweep_concurrency = 8,
+    ordered_output = False,
+    reorder_buffer_size = 1000,
+    drain_timeout = 30,
+    token_estimator = None,
+    truncation = TRUNCATE_HEAD,
     ):
     
     # Constants
@@ -39,6 +66,13 @@ async def async_api_requests(
     checkpoint_interval = 1000  # <--- SAVE EVERY 1000 ITEMS
     last_saved_count = 0
 
+    # Task-specific request shaping (max_tokens, stop, logit_bias), see src/profiles.py.
+    # max_token caps the completion length of the profile.
+    request_profile = dict(request_profile or {})
+    if 'max_tokens' in request_profile:
+        request_profile['max_tokens'] = min(request_profile['max_tokens'], max_token)
+    completion_reservation = request_profile.get('max_tokens', 0) * choices
+
     request_header = {"Authorization": f"Bearer {api_key}"}
     queue_of_requests_to_retry = asyncio.Queue()
     status_tracker = StatusTracker()
@@ -63,83 +97,291 @@ async def async_api_requests(
     global pbar
     pbar = tqdm(total = testNum-dataNum) 
 
-    while(True):
-        if next_request is None:
-            if not queue_of_requests_to_retry.empty(): 
-                next_request = queue_of_requests_to_retry.get_nowait()
-            elif (not_finished):
-                if dataNum < testNum:                    
-                    request_id = data[dataNum]['id']
-                    messages = data[dataNum]['prompt']
-                    request_truth = data[dataNum]['ground_truth']
-                    
-                    request_json = {
-                        "model": model,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "top_p": 1,
-                        "n": choices,
-                        "stream": False,
-                    }
-                    next_request = APIRequest(
-                        request_id=request_id,
-                        request_json=request_json,
-                        request_truth=request_truth,
-                        token_consumption=num_tokens_from_messages(messages, model),
-                        attempts_left=max_attempts,
-                        metadata=request_json.pop("metadata", None),
-                        results_list=results_list,
-                    )
-                    status_tracker.num_tasks_started += 1
-                    status_tracker.num_tasks_in_progress += 1
-                    dataNum += 1
-                else:
-                    not_finished = False
+    pending_ids = []
+    last_status_time = 0
+    if token_estimator:
+        # Schedule on calibrated character-based estimates; only a sample is encoded exactly
+        with trace.span(tracer, 'calibrate token estimator', items=testNum - dataNum):
+            token_estimator.calibrate([item['prompt'] for item in data[dataNum:testNum]])
+            remaining_prompt_tokens = sum(item['prompt_tokens'] if 'prompt_tokens' in item else token_estimator.estimate(item['prompt'])
+                                          for item in data[dataNum:testNum])
+        tqdm.write(f"Token estimator: {token_estimator.summary()}")
+    else:
+        # Count every remaining prompt in one batched pass; build_request then hits the token cache
+        # (items carrying an indexed 'prompt_tokens' count are not encoded at all)
+        with trace.span(tracer, 'count remaining tokens', items=testNum - dataNum):
+            remaining_items = data[dataNum:testNum]
+            remaining_prompt_tokens = sum(item['prompt_tokens'] for item in remaining_items if 'prompt_tokens' in item)
+            remaining_prompt_tokens += sum(num_tokens_batch([item['prompt'] for item in remaining_items if 'prompt_tokens' not in item], model))
+    if governor:
+        governor.remaining_items = testNum - dataNum
+        governor.remaining_prompt_tokens = remaining_prompt_tokens
+
+    # Dispatch up to twice the average per-loop rate so loop overhead does not cap throughput,
+    # without releasing the whole bucket in a single burst
+    max_dispatch_per_loop = max(1, math.ceil(max_requests_per_minute / 60.0 * seconds_to_sleep_each_loop * 2))
+
+    # One pooled session for the whole run; no connection cap, as with a session per request
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    status_tracker.time_of_last_checkpoint = time.time()
+    checkpoint_writer = CheckpointWriter(results_json_file, tracer)
+    status_tracker.histogram_key = f"{task}/{model}"
+    status_tracker.tracer = tracer
+    status_tracker.circuit_breaker = circuit_breaker
+    last_breaker_state = CLOSED
+    status_tracker.sweep_pending = sweep_passes > 0
+    ordered_writer = None
+    if ordered_output:
+        # Input-order copy of the results, streamed through a bounded reorder buffer
+        ordered_writer = OrderedWriter(os.path.join(result_file_path, result_file_name + "_ordered.json"), reorder_buffer_size, first_seq=dataNum)
+        status_tracker.ordered_writer = ordered_writer
+    status_tracker.token_estimator = token_estimator
+    trace_file = None
+    if trace_attempts:
+        # One compact JSON line per attempt, appended at every checkpoint
+        trace_file = os.path.join(result_file_path, result_file_name + ".trace.jsonl")
+        open(trace_file, "w").close()
+        status_tracker.attempt_traces = []
+    metrics_runner = None
+    if metrics_port:
+        metrics_runner = await start_metrics_exporter(status_tracker, metrics_port, host=metrics_host, labels={'task': task, 'dataset': dataset, 'model': model})
+        tqdm.write(f"Metrics exporter on http://{metrics_host}:{metrics_port}/metrics")
+
+    # Ctrl-C / SIGTERM: stop dispatching, drain in-flight requests for up to drain_timeout
+    # seconds, flush results and write a resume manifest. A second signal stops the drain.
+    in_flight_tasks = {}
+    drain_deadline = None
+    force_stop = False
+
+    def request_shutdown(signame):
+        nonlocal force_stop
+        if status_tracker.stop_reason is None:
+            status_tracker.stop_reason = f"received {signame}"
+        else:
+            force_stop = True
+
+    loop = asyncio.get_running_loop()
+    handled_signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig.name)
+            handled_signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            # No loop signal handlers on this platform; Ctrl-C keeps its default behaviour
+            pass
+
+    def build_request(item, seq):
+        request_json = {
+            "model": model,
+            "messages": item['prompt'],
+            "temperature": temperature,
+            "top_p": 1,
+            "n": choices,
+            "stream": False,
+            **request_profile,
+        }
+        with trace.span(tracer, 'count tokens', id=item['id']):
+            if 'prompt_tokens' in item:
+                # Exact count from the dataset's token index
+                prompt_tokens = item['prompt_tokens']
+            elif token_estimator:
+                prompt_tokens = token_estimator.estimate(item['prompt'])
+            else:
+                prompt_tokens = num_tokens_from_messages(item['prompt'], model)
+        return APIRequest(
+            request_id=item['id'],
+            request_json=request_json,
+            request_truth=item['ground_truth'],
+            token_consumption=prompt_tokens + completion_reservation,
+            prompt_tokens=prompt_tokens,
+            attempts_left=max_attempts,
+            metadata=request_json.pop("metadata", None),
+            results_list=results_list,
+            response_parser=response_parser,
+            seq=seq,
+            truncation=truncation,
+        )
 
+    while(True):
         current_time = time.time()
         seconds_since_update = current_time - last_update_time
         available_request_capacity = min(available_request_capacity + max_requests_per_minute * seconds_since_update / 60.0, max_requests_per_minute)
         available_token_capacity = min(available_token_capacity + max_tokens_per_minute * seconds_since_update / 60.0, max_tokens_per_minute)
         last_update_time = current_time
 
-        if next_request:
+        # Dispatch as many requests as the capacity allows in this loop iteration; once a stop
+        # is requested nothing new or retried is sent (the stop block below collects it instead)
+        dispatched_this_loop = 0
+        while dispatched_this_loop < max_dispatch_per_loop and not status_tracker.stop_reason:
+            if next_request is None:
+                if not queue_of_requests_to_retry.empty(): 
+                    next_request = queue_of_requests_to_retry.get_nowait()
+                elif (not_finished) and not (ordered_writer and ordered_writer.window_full(dataNum)):
+                    if dataNum < testNum:                    
+                        next_request = build_request(data[dataNum], dataNum)
+                        status_tracker.num_tasks_started += 1
+                        status_tracker.num_tasks_in_progress += 1
+                        dataNum += 1
+                    else:
+                        not_finished = False
+
+            if next_request is None:
+                break
             next_request_tokens = next_request.token_consumption
-            if available_request_capacity >= 1 and available_token_capacity >= next_request_tokens:
-                available_request_capacity -= 1
-                available_token_capacity -= next_request_tokens
-                next_request.attempts_left -= 1
-
-                asyncio.create_task(
-                    next_request.call_api(
-                        request_url=request_url,
-                        request_header=request_header,
-                        retry_queue=queue_of_requests_to_retry,
-                        save_filepath=results_json_file,
-                        status_tracker=status_tracker,
-                    )
+            if not (available_request_capacity >= 1 and available_token_capacity >= next_request_tokens and (governor is None or governor.allow(status_tracker, next_request.prompt_tokens))):
+                break
+            if circuit_breaker and not circuit_breaker.allow_dispatch():
+                break
+            if max_concurrent_requests and status_tracker.num_requests_in_flight >= max_concurrent_requests:
+                break
+
+            available_request_capacity -= 1
+            available_token_capacity -= next_request_tokens
+            if governor:
+                governor.on_dispatch(next_request.prompt_tokens, new_item=next_request.attempts_left == max_attempts)
+            next_request.attempts_left -= 1
+            next_request.time_dispatched = time.time()
+            if circuit_breaker:
+                next_request.is_probe = circuit_breaker.on_dispatch()
+            status_tracker.num_attempts += 1
+            status_tracker.num_requests_in_flight += 1
+            dispatched_this_loop += 1
+
+            request_task = asyncio.create_task(
+                next_request.call_api(
+                    session=session,
+                    request_url=request_url,
+                    request_header=request_header,
+                    retry_queue=queue_of_requests_to_retry,
+                    save_filepath=results_json_file,
+                    status_tracker=status_tracker,
                 )
-                next_request = None
+            )
+            in_flight_tasks[request_task] = next_request
+            request_task.add_done_callback(lambda done: in_flight_tasks.pop(done, None))
+            next_request = None
+
+        status_tracker.available_request_capacity = available_request_capacity
+        status_tracker.available_token_capacity = available_token_capacity
 
         # --- CHECKPOINT SAVING LOGIC ---
         current_count = len(results_list)
         if current_count - last_saved_count >= checkpoint_interval:
-            write_file(results_list, results_json_file)
+            # Serialization runs on the writer thread; the loop only pays for the snapshot
+            with trace.span(tracer, 'checkpoint snapshot', items=current_count):
+                status_tracker.checkpoint_blocked_seconds += checkpoint_writer.submit(results_list)
             last_saved_count = current_count
+            status_tracker.time_of_last_checkpoint = time.time()
+            if trace_file:
+                write_attempt_traces(status_tracker, trace_file)
+            if ordered_writer:
+                ordered_writer.flush()
             # Log checkpoint to console without breaking TQDM flow
             tqdm.write(f"Checkpoint saved: {current_count} items currently processed.")
+        status_tracker.num_results_unsaved = current_count - last_saved_count
+
+        if circuit_breaker and circuit_breaker.state != last_breaker_state:
+            tqdm.write(f"Circuit breaker {last_breaker_state} -> {circuit_breaker.state}")
+            last_breaker_state = circuit_breaker.state
+
+        # --- BUDGET / DEADLINE GOVERNOR ---
+        if governor:
+            if current_time - last_status_time >= 5:
+                pbar.set_postfix_str(governor.summary(status_tracker))
+                last_status_time = current_time
+            if governor.stop_reason and status_tracker.stop_reason is None:
+                status_tracker.stop_reason = governor.stop_reason
+
+        # --- STOP (governor or signal): drain, then hand everything unfinished to the resume manifest ---
+        if status_tracker.stop_reason:
+            if drain_deadline is None:
+                tqdm.write(f"Stopping run: {status_tracker.stop_reason}. Draining in-flight requests (up to {drain_timeout}s)...")
+                logging.warning(f"Stopping run: {status_tracker.stop_reason}")
+                drain_deadline = time.time() + drain_timeout
+                not_finished = False
+            if next_request is not None:
+                pending_ids.append(next_request.request_id)
+                status_tracker.num_tasks_in_progress -= 1
+                next_request = None
+            while not queue_of_requests_to_retry.empty():
+                pending_ids.append(queue_of_requests_to_retry.get_nowait().request_id)
+                status_tracker.num_tasks_in_progress -= 1
+            if in_flight_tasks and (force_stop or time.time() >= drain_deadline):
+                tqdm.write(f"Drain timeout: abandoning {len(in_flight_tasks)} in-flight requests")
+                abandoned = list(in_flight_tasks.items())
+                for pending, request in abandoned:
+                    pending.cancel()
+                    pending_ids.append(request.request_id)
+                await asyncio.gather(*(pending for pending, _ in abandoned), return_exceptions=True)
+                status_tracker.num_tasks_in_progress -= len(abandoned)
+                status_tracker.num_requests_in_flight = 0
 
         if status_tracker.num_tasks_in_progress == 0 and not not_finished:
+            if sweep_passes > 0 and not status_tracker.stop_reason:
+                # --- FAILED-ITEM SWEEP ---
+                # Re-queue permanently failed items with fresh attempts and lower concurrency,
+                # reusing the live session and the in-memory prompts
+                sweep_passes -= 1
+                status_tracker.sweep_pending = sweep_passes > 0
+                swept = sweep_failed_items(results_list, data[:testNum], build_request, queue_of_requests_to_retry)
+                if swept:
+                    tqdm.write(f"Sweep: re-queued {len(swept)} failed items at concurrency {sweep_concurrency}")
+                    status_tracker.num_tasks_in_progress += len(swept)
+                    status_tracker.num_items_swept += len(swept)
+                    max_concurrent_requests = sweep_concurrency
+                    last_saved_count = len(results_list)
+                    pbar.total += len(swept)
+                    pbar.refresh()
+                    if governor:
+                        governor.remaining_items += len(swept)
+                        governor.remaining_prompt_tokens += sum(request.prompt_tokens for request in swept)
+                    continue
             break
 
         await asyncio.sleep(seconds_to_sleep_each_loop)
 
         seconds_since_rate_limit_error = (time.time() - status_tracker.time_of_last_rate_limit_error)
         if seconds_since_rate_limit_error < seconds_to_pause_after_rate_limit_error:
-            await asyncio.sleep(seconds_to_pause_after_rate_limit_error - seconds_since_rate_limit_error)
+            with trace.span(tracer, 'rate-limit pause'):
+                await asyncio.sleep(seconds_to_pause_after_rate_limit_error - seconds_since_rate_limit_error)
 
     # Final Save to ensure the last batch (the remainder of 1000) is written
-    write_file(results_list, results_json_file)
+    try:
+        checkpoint_writer.close()
+    except Exception as e:
+        # The final write below still runs; it supersedes every checkpoint
+        tqdm.write(f"Background checkpoint failed: {e!r}")
+        logging.error(f"Background checkpoint failed: {e!r}")
+    with trace.span(tracer, 'final write', items=len(results_list)):
+        write_file(results_list, results_json_file)
+    if ordered_writer:
+        ordered_writer.close()
+        tqdm.write(f"Ordered output: {ordered_writer.num_written} items in {ordered_writer.ordered_json_file}, reorder buffer peak {ordered_writer.max_buffered}/{reorder_buffer_size}")
+    if checkpoint_writer.num_writes:
+        tqdm.write(f"{checkpoint_writer.num_writes} background checkpoints, dispatch loop blocked {status_tracker.checkpoint_blocked_seconds:.3f}s in total")
+    if trace_file:
+        write_attempt_traces(status_tracker, trace_file)
+        tqdm.write(latency_report(status_tracker))
     pbar.close()
+    await session.close()
+    for sig in handled_signals:
+        loop.remove_signal_handler(sig)
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
+    if tracer:
+        chrome_trace_file = tracer.save(os.path.join(result_file_path, result_file_name + ".chrome_trace.json"))
+        tqdm.write(f"Chrome trace saved to: {chrome_trace_file}")
+
+    if governor:
+        tqdm.write(f"Governor: {governor.summary(status_tracker)}")
+    if token_estimator:
+        tqdm.write(f"Token estimator: {token_estimator.summary()}")
+    if status_tracker.stop_reason:
+        manifest_file = write_resume_manifest(results_json_file, status_tracker.stop_reason, dataNum, results_list, pending_ids)
+        tqdm.write(f"Run stopped early ({status_tracker.stop_reason}). Resume manifest: {manifest_file}")
+    return status_tracker
 
 @dataclass
 class StatusTracker:
@@ -151,6 +393,52 @@ class StatusTracker:
     num_api_errors: int = 0
     num_other_errors: int = 0
     time_of_last_rate_limit_error: int = 0
+    prompt_tokens_used: int = 0
+    completion_tokens_used: int = 0
+    num_attempts: int = 0
+    available_request_capacity: float = 0
+    available_token_capacity: float = 0
+    num_requests_in_flight: int = 0
+    num_results_unsaved: int = 0
+    time_of_last_checkpoint: float = 0
+    checkpoint_blocked_seconds: float = 0
+    request_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    histogram_key: str = ''
+    # {"task/model": {"queue" | "first_byte" | "attempt": LatencyHistogram}}
+    latency_histograms: dict = field(default_factory=dict)
+    attempt_traces: list = None  # attempt records awaiting write_attempt_traces, None when tracing is off
+    tracer: object = None  # src.trace.ChromeTracer of the run, if any
+    circuit_breaker: object = None  # src.breaker.CircuitBreaker of the run, if any
+    num_attempts_refunded: int = 0
+    num_non_retryable_errors: int = 0
+    num_context_truncations: int = 0
+    num_items_swept: int = 0  # failed items re-queued by the sweep (num_tasks_failed keeps counting them)
+    num_items_recovered: int = 0  # swept items that then succeeded
+    sweep_pending: bool = False  # a failed-item sweep may still retry failed items
+    ordered_writer: object = None  # src.writer.OrderedWriter of the run, if any
+    stop_reason: str = None  # set by the governor or a termination signal
+    token_estimator: object = None  # src.tokens.TokenEstimator used for scheduling, if any
+
+    def record_attempt(self, request, first_byte, completed, outcome):
+        """Adds one attempt to the per task/model histograms and, when tracing, the trace buffer."""
+        histograms = self.latency_histograms.setdefault(self.histogram_key, {
+            'queue': LatencyHistogram(), 'first_byte': LatencyHistogram(), 'attempt': LatencyHistogram()})
+        histograms['queue'].observe(request.time_dispatched - request.time_queued)
+        if first_byte is not None:
+            histograms['first_byte'].observe(first_byte - request.time_dispatched)
+        histograms['attempt'].observe(completed - request.time_dispatched)
+        if self.tracer is not None:
+            self.tracer.attempt(request.request_id, request.time_dispatched, completed, outcome)
+        if self.attempt_traces is not None:
+            self.attempt_traces.append({
+                'id': request.request_id,
+                'attempt': len(request.result) + 1,
+                'queued': round(request.time_queued, 3),
+                'dispatched': round(request.time_dispatched, 3),
+                'first_byte': round(first_byte, 3) if first_byte is not None else None,
+                'completed': round(completed, 3),
+                'outcome': outcome,
+            })
 
 @dataclass
 class APIRequest:
@@ -162,45 +450,181 @@ class APIRequest:
     metadata: dict
     results_list: list
     result: list = field(default_factory=list)
-
-    async def call_api(self, request_url, request_header, retry_queue, save_filepath, status_tracker):
+    prompt_tokens: int = 0
+    response_parser: object = None  # callable(response) -> dict of extra result fields
+    time_queued: float = field(default_factory=time.time)
+    time_dispatched: float = 0
+    is_probe: bool = False
+    seq: int = None  # position of the item in the input data
+    swept: bool = False  # re-queued by the failed-item sweep
+    truncation: str = TRUNCATE_HEAD  # strategy used when a context-length error forces truncation
+
+    def truncate_to_context(self, error):
+        """Shrinks the last (item) message so the request fits the context window; False if it cannot."""
+        model = self.request_json['model']
+        messages = self.request_json['messages']
+        last_tokens = num_tokens_from_messages(messages[-1:], model)
+        overflow = errors.context_overflow(error)
+        if overflow:
+            limit, requested = overflow
+            budget = last_tokens - (requested - limit) - CONTEXT_TRUNCATION_MARGIN
+        else:
+            budget = int(last_tokens * 0.75)
+        if budget <= 0:
+            return False
+        self.request_json = {**self.request_json, 'messages': messages[:-1] + [message_process(messages[-1], budget, model, strategy=self.truncation)]}
+        prompt_tokens = num_tokens_from_messages(self.request_json['messages'], model)
+        self.token_consumption += prompt_tokens - self.prompt_tokens
+        self.prompt_tokens = prompt_tokens
+        return True
+
+    async def call_api(self, session, request_url, request_header, retry_queue, save_filepath, status_tracker):
         error = None
+        first_byte = None
+        http_status = None
+        outcome = 'ok'
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url=request_url, headers=request_header, json=self.request_json) as response_raw:
-                    response = await response_raw.json()
+            async with session.post(url=request_url, headers=request_header, json=self.request_json) as response_raw:
+                first_byte = time.time()
+                http_status = response_raw.status
+                response = await response_raw.json()
             if "error" in response:
-                status_tracker.num_api_errors += 1
                 error = response
-                if "Rate limit" in response["error"].get("message", ""):
-                    status_tracker.time_of_last_rate_limit_error = time.time()
-                    status_tracker.num_rate_limit_errors += 1
-                    status_tracker.num_api_errors -= 1
         except Exception as e:
-            status_tracker.num_other_errors += 1
             error = e
+        completed = time.time()
+
+        error_type = None
+        if error is not None:
+            error_type = errors.classify_error(http_status, error)
+            outcome = error_type
+            if isinstance(error, Exception):
+                status_tracker.num_other_errors += 1
+            elif error_type == errors.RATE_LIMIT:
+                status_tracker.time_of_last_rate_limit_error = time.time()
+                status_tracker.num_rate_limit_errors += 1
+            else:
+                status_tracker.num_api_errors += 1
+        status_tracker.num_requests_in_flight -= 1
+        status_tracker.request_latency.observe(completed - self.time_dispatched)
+        status_tracker.record_attempt(self, first_byte, completed, outcome)
+
+        breaker = status_tracker.circuit_breaker
+        if breaker:
+            transient = error_type == errors.TRANSIENT
+            if transient or error is None or self.is_probe:
+                breaker.record(failed=transient, probe=self.is_probe)
+            self.is_probe = False
+            if transient and breaker.state != CLOSED:
+                # Failures during a provider outage do not use up the item's attempts
+                self.attempts_left += 1
+                status_tracker.num_attempts_refunded += 1
 
         if error:
             self.result.append(error)
-            if self.attempts_left > 0:
+            retry = error_type in errors.RETRYABLE
+            if error_type == errors.CONTEXT_LENGTH:
+                # Re-truncate the item message to fit and resubmit instead of repeating the same request
+                retry = self.truncate_to_context(error)
+                if retry:
+                    status_tracker.num_context_truncations += 1
+            elif not retry:
+                status_tracker.num_non_retryable_errors += 1
+                logging.warning(f"Non-retryable {error_type} error for {self.request_id}: {error}")
+            if retry and self.attempts_left > 0:
+                self.time_queued = time.time()
                 retry_queue.put_nowait(self)
             else:
-                result = {'id': self.request_id, 'ground_truth': self.request_truth, 'prompt': self.request_json, 'response': str(error)}
+                result = {'id': self.request_id, 'ground_truth': self.request_truth, 'prompt': self.request_json, 'response': str(error), 'error_type': error_type}
                 self.results_list.append(result)
+                if status_tracker.ordered_writer:
+                    sweepable = status_tracker.sweep_pending and error_type not in errors.UNSWEEPABLE
+                    status_tracker.ordered_writer.add(self.seq, result, parked=sweepable)
                 status_tracker.num_tasks_in_progress -= 1
                 status_tracker.num_tasks_failed += 1
                 pbar.update(1)
         else:
+            usage = response.get('usage') or {}
+            status_tracker.prompt_tokens_used += usage.get('prompt_tokens', 0)
+            status_tracker.completion_tokens_used += usage.get('completion_tokens', 0)
+            if status_tracker.token_estimator and usage.get('prompt_tokens'):
+                status_tracker.token_estimator.observe(self.request_json['messages'], usage['prompt_tokens'])
             result = {'id': self.request_id, 'ground_truth': self.request_truth, 'prompt': self.request_json, 'response': response}
+            if self.response_parser:
+                result.update(self.response_parser(response))
             self.results_list.append(result)
+            if status_tracker.ordered_writer:
+                status_tracker.ordered_writer.add(self.seq, result)
             status_tracker.num_tasks_in_progress -= 1
             status_tracker.num_tasks_succeeded += 1
+            if self.swept:
+                status_tracker.num_items_recovered += 1
             pbar.update(1)
 
 def write_file(results_list, results_json_file):
     with open(results_json_file, "w") as f:
         json.dump(results_list, f, indent=4)
 
+def sweep_failed_items(results_list, data, build_request, retry_queue):
+    """Moves failed results back onto the retry queue as fresh requests; returns the requests.
+
+    A result failed if its response is not a dict with 'choices'. Auth, invalid-request and
+    context-length failures (truncation already gave up) are left in place since they would
+    fail again straight away.
+    """
+    failed_ids = set()
+    kept = []
+    for result in results_list:
+        response = result.get('response')
+        if not (isinstance(response, dict) and 'choices' in response) and result.get('error_type') not in errors.UNSWEEPABLE:
+            failed_ids.add(result['id'])
+        else:
+            kept.append(result)
+    if not failed_ids:
+        return []
+    # Modify in place: every APIRequest holds a reference to this list
+    results_list[:] = kept
+    swept = [build_request(item, seq) for seq, item in enumerate(data) if item['id'] in failed_ids]
+    for request in swept:
+        request.swept = True
+        retry_queue.put_nowait(request)
+    return swept
+
+def write_attempt_traces(status_tracker, trace_file):
+    """Appends the buffered attempt records to the trace file and clears the buffer."""
+    with open(trace_file, "a") as f:
+        for attempt in status_tracker.attempt_traces:
+            f.write(json.dumps(attempt, separators=(',', ':')) + "\n")
+    status_tracker.attempt_traces.clear()
+
+def latency_report(status_tracker):
+    """Returns a text table of the p50/p90/p99 bucket bounds per task/model and phase."""
+    lines = [f"{'task/model':<30} | {'phase':<10} | {'count':>7} | {'p50':>6} | {'p90':>6} | {'p99':>6}"]
+    for key, histograms in status_tracker.latency_histograms.items():
+        for phase, histogram in histograms.items():
+            quantiles = [histogram.quantile(q) for q in (0.5, 0.9, 0.99)]
+            lines.append(f"{key:<30} | {phase:<10} | {histogram.count:>7} | " + ' | '.join(f"{str(q):>6}" for q in quantiles))
+    return '\n'.join(lines)
+
+def write_resume_manifest(results_json_file, reason, next_index, results_list, pending_ids):
+    """Writes <result>_resume.json describing where a stopped run should pick up.
+
+    `next_index` is the first index of `data` never dispatched; `pending_ids` were dispatched
+    or queued for retry but have no result in the results file and must be re-run too.
+    """
+    manifest_file = results_json_file[:-len(".json")] + "_resume.json"
+    manifest = {
+        'reason': reason,
+        'written_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results_file': results_json_file,
+        'num_completed': len(results_list),
+        'next_index': next_index,
+        'pending_ids': pending_ids,
+    }
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=4)
+    return manifest_file
+
 # import os
 # import json
 # import time
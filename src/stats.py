@@ -0,0 +1,41 @@
+import bisect
+from dataclasses import dataclass
+
+# Upper bounds in seconds, Prometheus-style (an implicit +Inf bucket follows)
+DEFAULT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+@dataclass
+class LatencyHistogram:
+    """Cumulative-bucket latency histogram in seconds."""
+    buckets: tuple = DEFAULT_LATENCY_BUCKETS
+    counts: list = None
+    count: int = 0
+    total: float = 0.0
+
+    def __post_init__(self):
+        if self.counts is None:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def cumulative_counts(self):
+        """Returns [(upper bound, observations <= bound)] including '+Inf'."""
+        cumulative = []
+        running = 0
+        for bound, n in zip(list(self.buckets) + ['+Inf'], self.counts):
+            running += n
+            cumulative.append((bound, running))
+        return cumulative
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-quantile (None when empty)."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        for bound, running in self.cumulative_counts():
+            if running >= target:
+                return bound
+        return '+Inf'
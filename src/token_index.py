@@ -0,0 +1,181 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from functools import lru_cache
+from src import tokens
+from src.dataset import source_stamp
+from src.governor import estimate_cost
+
+# Sidecar next to the data file: <dataset>-<split>.tokens.json (header) plus one int32
+# array per method, <dataset>-<split>.tokens.<method>.npy, aligned with the header ids.
+# A count of -1 means the method produced no prompt for that id.
+MISSING = -1
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Modules whose code shapes the indexed prompts; editing any of them makes the index stale
+TRANSFORM_MODULES = ('prompt.py', 'diffreduce.py', 'compress.py', 'tokens.py')
+
+@lru_cache(maxsize=None)
+def transforms_hash():
+    digest = hashlib.blake2b(digest_size=16)
+    for name in TRANSFORM_MODULES:
+        digest.update(file_hash(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)).encode())
+    return digest.hexdigest()
+
+# Digests of files hashed in this process, keyed by (path, size:mtime stamp)
+_hashed = {}
+
+def file_unchanged(path, stamp, digest):
+    """True if `path` still has the given digest; the file is only hashed when its size:mtime stamp moved."""
+    current = source_stamp(path)
+    if stamp == current:
+        return True
+    if (path, current) not in _hashed:
+        _hashed[(path, current)] = file_hash(path)
+    return digest == _hashed[(path, current)]
+
+def index_header_path(data_file):
+    return os.path.splitext(data_file)[0] + '.tokens.json'
+
+def index_array_path(data_file, method):
+    return os.path.splitext(data_file)[0] + f'.tokens.{method}.npy'
+
+class TokenIndex:
+    """Prompt token counts of one dataset split, per method, memory-mapped on first use."""
+
+    def __init__(self, data_file, header):
+        self.data_file = data_file
+        self.header = header
+        self.ids = header['ids']
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+        self.arrays = {}
+
+    @property
+    def methods(self):
+        return self.header['methods']
+
+    def counts(self, method):
+        """Returns the (memory-mapped) count array of `method`, aligned with `self.ids`."""
+        if method not in self.arrays:
+            self.arrays[method] = np.load(index_array_path(self.data_file, method), mmap_mode='r')
+        return self.arrays[method]
+
+    def get(self, method, id):
+        """Returns the prompt tokens of `id` under `method`, or None if not indexed."""
+        position = self.positions.get(id)
+        if method not in self.methods or position is None:
+            return None
+        count = int(self.counts(method)[position])
+        return None if count == MISSING else count
+
+    def stats(self, method, model='gpt-4o-mini', completion_tokens=50, bins=10):
+        counts = np.asarray(self.counts(method))
+        counts = counts[counts != MISSING]
+        if not len(counts):
+            return None
+        histogram, edges = np.histogram(counts, bins=bins)
+        return {
+            'items': int(len(counts)),
+            'total': int(counts.sum()),
+            'mean': float(counts.mean()),
+            'p50': int(np.percentile(counts, 50)),
+            'p90': int(np.percentile(counts, 90)),
+            'p99': int(np.percentile(counts, 99)),
+            'max': int(counts.max()),
+            'histogram': list(zip(edges[:-1].round().astype(int).tolist(), histogram.tolist())),
+            'estimated_cost': estimate_cost(model, int(counts.sum()), completion_tokens * len(counts)),
+        }
+
+def build_token_index(root, task, dataset, TEST, methods, max_tokens=8000, model='gpt-4o-mini'):
+    """Generates the prompts of every method for the whole split and writes the sidecar index."""
+    from src import prompt
+    data_file = prompt.data_file_path(root, task, dataset, TEST)
+    prompt_file = prompt.prompt_file_path(root, task, dataset)
+    with open(data_file) as f:
+        ids = list(json.load(f)[dataset])
+    positions = {id: position for position, id in enumerate(ids)}
+
+    indexed_methods = []
+    for method in methods:
+        if method == 'summary':
+            continue
+        prompts = prompt.generate_prompt(root, task, dataset, method, max_tokens=max_tokens, TEST=TEST, testNum=len(ids))
+        counts = np.full(len(ids), MISSING, dtype=np.int32)
+        for item, count in zip(prompts, tokens.num_tokens_batch([item['prompt'] for item in prompts], model)):
+            counts[positions[item['id']]] = count
+        np.save(index_array_path(data_file, method), counts)
+        indexed_methods.append(method)
+
+    header = {
+        'data_hash': file_hash(data_file),
+        'data_stamp': source_stamp(data_file),
+        'prompt_hash': file_hash(prompt_file),
+        'prompt_stamp': source_stamp(prompt_file),
+        'transforms_hash': transforms_hash(),
+        'encoding': tokens.get_encoding(model).name,
+        'max_tokens': max_tokens,
+        'methods': indexed_methods,
+        'ids': ids,
+    }
+    with open(index_header_path(data_file), 'w') as f:
+        json.dump(header, f)
+    return TokenIndex(data_file, header)
+
+def load_token_index(root, task, dataset, TEST, max_tokens=8000, model='gpt-4o-mini'):
+    """Returns the TokenIndex of a split, or None if it is missing or stale."""
+    from src import prompt
+    data_file = prompt.data_file_path(root, task, dataset, TEST)
+    prompt_file = prompt.prompt_file_path(root, task, dataset)
+    header_file = index_header_path(data_file)
+    if not os.path.exists(header_file):
+        return None
+    with open(header_file) as f:
+        header = json.load(f)
+    if (header['max_tokens'] != max_tokens
+            or header['encoding'] != tokens.get_encoding(model).name
+            or header.get('transforms_hash') != transforms_hash()
+            or not file_unchanged(data_file, header.get('data_stamp'), header['data_hash'])
+            or not file_unchanged(prompt_file, header.get('prompt_stamp'), header['prompt_hash'])):
+        return None
+    return TokenIndex(data_file, header)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect the prompt token-count index of a dataset split')
+    parser.add_argument('command', choices=['build', 'stats'])
+    parser.add_argument('--root', default=os.path.join(os.getcwd(), 'data'))
+    parser.add_argument('--task', required=True)
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--split', default='test', choices=['vali', 'test', 'remain'])
+    parser.add_argument('--methods', nargs='+', default=['base', 'one-shot', 'few-shot', 'info-manual', 'prompt-eng', 'info-gpt'])
+    parser.add_argument('--max-tokens', type=int, default=8000)
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--completion-tokens', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = build_token_index(args.root, args.task, args.dataset, args.split, args.methods, args.max_tokens, args.model)
+    else:
+        index = load_token_index(args.root, args.task, args.dataset, args.split, args.max_tokens, args.model)
+        if index is None:
+            raise SystemExit('No up-to-date token index; run the build command first')
+
+    for method in index.methods:
+        stats = index.stats(method, args.model, args.completion_tokens)
+        if stats is None:
+            continue
+        print(f"\n{method}: {stats['items']} items, {stats['total']:,} prompt tokens, est. ${stats['estimated_cost']:.4f}")
+        print(f"  mean {stats['mean']:.0f}  p50 {stats['p50']}  p90 {stats['p90']}  p99 {stats['p99']}  max {stats['max']}")
+        peak = max(count for _, count in stats['histogram']) or 1
+        for edge, count in stats['histogram']:
+            print(f"  {edge:>7} | {'#' * round(40 * count / peak)} {count}")
+
+if __name__ == '__main__':
+    main()
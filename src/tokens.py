@@ -1,55 +1,309 @@
+import os
+import math
+import random
+import hashlib
+import argparse
+import threading
 import tiktoken
+import tiktoken.load
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
 
-def num_tokens_from_messages(messages, model="gpt-4o-mini"):
-    """Returns the number of tokens used by a list of messages for GPT-4 or GPT-4o-mini."""
+# tiktoken downloads its BPE files on first use and caches them in $TIKTOKEN_CACHE_DIR.
+# A bundle prefetched into tiktoken_cache/ at the project root makes runs work offline.
+BUNDLED_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tiktoken_cache')
+ENCODING_NAMES = ("o200k_base", "cl100k_base")
+# BPE blob (URL, sha256) behind each bundled encoding, as in tiktoken_ext.openai_public
+ENCODING_BLOBS = {
+    "o200k_base": ("https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+                   "446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d"),
+    "cl100k_base": ("https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+                    "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"),
+}
+
+# Both GPT-4 and GPT-4o models share these specific message overhead constants
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3  # every reply is primed with <|start|>assistant<|message|>
+
+# Token counts of strings already seen, keyed by (encoding name, content hash). Few-shot
+# examples and system prompts repeat in every item of a dataset and are encoded only once.
+MAX_CACHED_COUNTS = 1_000_000
+_token_counts = {}
+
+def use_cache_dir(cache_dir):
+    """Points tiktoken at a local encoding cache; call before the first encoding is loaded."""
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(BUNDLED_CACHE_DIR):
+    use_cache_dir(BUNDLED_CACHE_DIR)
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4o-mini"):
+    """Returns the (cached) tiktoken encoding of a model, falling back to o200k/cl100k for unknown names."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        # Fallback to o200k for 4o-mini or cl100k for gpt-4
-        encoding = tiktoken.get_encoding("o200k_base") if "4o" in model else tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("o200k_base") if "4o" in model else tiktoken.get_encoding("cl100k_base")
+
+def warm_encoding(model="gpt-4o-mini"):
+    """Loads the model's encoding on a background thread (e.g. while the user is still typing)."""
+    thread = threading.Thread(target=get_encoding, args=(model,), name='encoding-warmup', daemon=True)
+    thread.start()
+    return thread
+
+def prefetch_encodings(cache_dir, names=ENCODING_NAMES):
+    """Downloads the given encodings into `cache_dir`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    use_cache_dir(cache_dir)
+    for name in names:
+        tiktoken.get_encoding(name)
+        print(f"Fetched {name} into {cache_dir}")
+
+def blob_cache_path(cache_dir, url):
+    # tiktoken names each cached blob after the sha1 of its URL (tiktoken.load.read_file_cached)
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+def verify_encodings(cache_dir, names=ENCODING_NAMES):
+    """Checks that each encoding loads from `cache_dir` alone; returns {name: error or None}.
+
+    The BPE blob must be cached under tiktoken's key with the expected sha256, so loading
+    it never touches the network; it is then parsed and a sample is round-tripped.
+    """
+    use_cache_dir(cache_dir)
+    sample = "Bug report: heap-buffer-overflow in parser.c (CVE-2024-0001) ✓"
+    problems = {}
+    for name in names:
+        if name not in ENCODING_BLOBS:
+            problems[name] = "no known BPE blob for this encoding"
+            continue
+        url, expected_hash = ENCODING_BLOBS[name]
+        path = blob_cache_path(cache_dir, url)
+        if not os.path.exists(path):
+            problems[name] = f"{os.path.basename(path)} (for {url}) is missing from {cache_dir}"
+            continue
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != expected_hash:
+                problems[name] = f"{path} does not match the sha256 of {url}"
+                continue
+        try:
+            if not tiktoken.load.load_tiktoken_bpe(url, expected_hash):
+                problems[name] = f"{path} holds no merges"
+                continue
+            encoding = tiktoken.get_encoding(name)
+            problems[name] = None if encoding.decode(encoding.encode(sample)) == sample else "round-trip mismatch"
+        except Exception as e:
+            problems[name] = str(e)
+    return problems
 
-    # Both GPT-4 and GPT-4o models share these specific message overhead constants
-    tokens_per_message = 3
-    tokens_per_name = 1
-        
+def content_key(encoding, text):
+    return encoding.name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def remember_count(key, count):
+    if len(_token_counts) >= MAX_CACHED_COUNTS:
+        _token_counts.clear()
+    _token_counts[key] = count
+
+def count_text_tokens(text, encoding):
+    """Returns the memoized token count of `text` under `encoding`."""
+    key = content_key(encoding, text)
+    count = _token_counts.get(key)
+    if count is None:
+        count = len(encoding.encode(text))
+        remember_count(key, count)
+    return count
+
+def count_message_tokens(messages, encoding):
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
+        num_tokens += TOKENS_PER_MESSAGE
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += count_text_tokens(value, encoding)
             if key == "name":
-                num_tokens += tokens_per_name
-    
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
-
-def message_process(message, max_token=128000, model="gpt-4o-mini", stopwords_process=None):
-    """Truncates message content to fit within the max_token limit using model-specific encoding."""
-    
-    # 5 token buffer for message formatting overhead
-    stop_num = max_token - 5 
-    
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("o200k_base") if "4o" in model else tiktoken.get_encoding("cl100k_base")
-        
-    current_tokens = 4 # Base overhead
-    
-    for key, value in message.items():
-        if stopwords_process: 
-            value = stopwords_process(value)
-            
-        words = value.split(" ")
-        content_list = []
-        
-        for word in words:
-            # Estimate word tokens (+1 for the space)
-            word_tokens = len(encoding.encode(word)) + 1 
-            if current_tokens + word_tokens < stop_num:
-                content_list.append(word)
-                current_tokens += word_tokens
-            else:
-                break
-                
-    return {"role": message["role"], "content": " ".join(content_list)}
\ No newline at end of file
+                num_tokens += TOKENS_PER_NAME
+    return num_tokens + TOKENS_PER_REPLY
+
+def num_tokens_from_messages(messages, model="gpt-4o-mini"):
+    """Returns the number of tokens used by a list of messages for GPT-4 or GPT-4o-mini."""
+    return count_message_tokens(messages, get_encoding(model))
+
+def num_tokens_batch(message_lists, model="gpt-4o-mini", num_threads=8):
+    """Returns num_tokens_from_messages for every list of messages in `message_lists`.
+
+    Strings not counted before are deduplicated and encoded together with tiktoken's
+    multi-threaded encode_batch, so counting a whole dataset up front costs one pass over
+    its distinct contents; later single-item counts are then cache lookups.
+    """
+    encoding = get_encoding(model)
+    uncounted = {}
+    for messages in message_lists:
+        for message in messages:
+            for value in message.values():
+                key = content_key(encoding, value)
+                if key not in _token_counts and key not in uncounted:
+                    uncounted[key] = value
+    if uncounted:
+        encoded = encoding.encode_batch(list(uncounted.values()), num_threads=num_threads)
+        for key, tokens in zip(uncounted, encoded):
+            remember_count(key, len(tokens))
+    return [count_message_tokens(messages, encoding) for messages in message_lists]
+
+def num_tokens_from_text(text, model="gpt-4o-mini"):
+    """Returns the number of tokens of a plain string."""
+    return count_text_tokens(text, get_encoding(model))
+
+def measure_messages(messages):
+    """Returns (content characters, exact message overhead tokens) of a list of messages."""
+    chars = 0
+    overhead = TOKENS_PER_REPLY
+    for message in messages:
+        overhead += TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            chars += len(value)
+            if key == "name":
+                overhead += TOKENS_PER_NAME
+    return chars, overhead
+
+@dataclass
+class TokenEstimator:
+    """Estimates prompt tokens from character counts for rate-limit scheduling, without BPE.
+
+    The message overhead is exact and content tokens are `tokens_per_char * chars`, with the
+    ratio fitted on a sample of exact counts from the dataset being run. `error_bound` is the
+    95th percentile relative under-estimate seen so far and is added on top, so the TPM bucket
+    is rarely under-charged. `observe` keeps refitting both against usage.prompt_tokens.
+    Truncation decisions keep using the exact counts.
+    """
+    model: str = "gpt-4o-mini"
+    tokens_per_char: float = 0.25
+    error_bound: float = 0.1
+    decay: float = 0.999  # weight of older observations per new one
+    weighted_tokens: float = 0
+    weighted_chars: float = 0
+    recent_errors: deque = field(default_factory=lambda: deque(maxlen=500))
+    num_observations: int = 0
+
+    def raw_estimate(self, messages):
+        chars, overhead = measure_messages(messages)
+        return overhead + self.tokens_per_char * chars
+
+    def estimate(self, messages):
+        return math.ceil(self.raw_estimate(messages) * (1 + self.error_bound))
+
+    def calibrate(self, message_lists, sample_size=200, seed=0):
+        """Fits the ratio and error bound on up to `sample_size` exactly counted prompts."""
+        sample = random.Random(seed).sample(message_lists, min(sample_size, len(message_lists)))
+        if not sample:
+            return self
+        exact = num_tokens_batch(sample, self.model)
+        measured = [measure_messages(messages) for messages in sample]
+        self.weighted_chars = sum(chars for chars, _ in measured)
+        self.weighted_tokens = sum(count - overhead for count, (_, overhead) in zip(exact, measured))
+        if self.weighted_chars:
+            self.tokens_per_char = self.weighted_tokens / self.weighted_chars
+        self.recent_errors.extend(count / self.raw_estimate(messages) - 1 for count, messages in zip(exact, sample))
+        self.error_bound = self.percentile_error()
+        return self
+
+    def observe(self, messages, prompt_tokens):
+        """Refits against the prompt_tokens the provider reported for `messages`."""
+        chars, overhead = measure_messages(messages)
+        if not chars:
+            return
+        self.recent_errors.append(prompt_tokens / self.raw_estimate(messages) - 1)
+        self.weighted_tokens = self.weighted_tokens * self.decay + (prompt_tokens - overhead)
+        self.weighted_chars = self.weighted_chars * self.decay + chars
+        self.tokens_per_char = self.weighted_tokens / self.weighted_chars
+        self.num_observations += 1
+        if self.num_observations % 50 == 0:
+            self.error_bound = self.percentile_error()
+
+    def percentile_error(self, percentile=95):
+        errors = sorted(self.recent_errors)
+        return max(errors[int(percentile / 100 * (len(errors) - 1))], 0) if errors else self.error_bound
+
+    def summary(self):
+        return f"{self.tokens_per_char:.4f} tokens/char, +{self.error_bound:.1%} error bound, {self.num_observations} observations"
+
+TRUNCATE_HEAD = "head"
+TRUNCATE_TAIL = "tail"
+TRUNCATE_HEAD_TAIL = "head_tail"
+ELISION_MARKER = "\n...\n"
+
+def truncate_text(text, max_tokens, encoding, strategy=TRUNCATE_HEAD):
+    """Cuts `text` to at most `max_tokens` tokens with a single encode.
+
+    `head` keeps the start, `tail` the end and `head_tail` both ends around an elision
+    marker. A decoded slice can re-encode to a few more tokens than it was cut from, so the
+    longest slice that still fits is found by binary search (usually the first probe fits).
+    """
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    marker_tokens = len(encoding.encode(ELISION_MARKER)) if strategy == TRUNCATE_HEAD_TAIL else 0
+    if strategy == TRUNCATE_HEAD or (strategy == TRUNCATE_HEAD_TAIL and max_tokens <= marker_tokens):
+        # (a budget too small for the elision marker plus content falls back to head)
+        def cut(n):
+            return encoding.decode(tokens[:n]).rstrip("\ufffd")
+    elif strategy == TRUNCATE_TAIL:
+        def cut(n):
+            return encoding.decode(tokens[len(tokens) - n:]).lstrip("\ufffd")
+    elif strategy == TRUNCATE_HEAD_TAIL:
+        def cut(n):
+            n = max(n - marker_tokens, 0)
+            head, tail = (n + 1) // 2, n // 2
+            return (encoding.decode(tokens[:head]).rstrip("\ufffd") + ELISION_MARKER
+                    + encoding.decode(tokens[len(tokens) - tail:]).lstrip("\ufffd"))
+    else:
+        raise ValueError(f"unknown truncation strategy: {strategy}")
+
+    def fits(n):
+        return len(encoding.encode(cut(n))) <= max_tokens
+
+    if fits(max_tokens):
+        return cut(max_tokens)
+    low, high = 0, max_tokens - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return cut(low)
+
+def message_process(message, max_token=128000, model="gpt-4o-mini", stopwords_process=None, strategy=TRUNCATE_HEAD):
+    """Truncates message content to fit within the max_token limit using model-specific encoding.
+
+    The content is encoded once and cut at the exact token budget (see truncate_text for the
+    `head`, `tail` and `head_tail` strategies).
+    """
+    encoding = get_encoding(model)
+    content = message["content"]
+    if stopwords_process:
+        content = stopwords_process(content)
+
+    # 4 tokens of message formatting overhead plus a 5 token buffer
+    budget = max_token - 5 - 4
+    return {"role": message["role"], "content": truncate_text(content, budget, encoding, strategy)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the local tiktoken encoding bundle')
+    parser.add_argument('command', choices=['prefetch', 'verify'])
+    parser.add_argument('--cache-dir', default=os.environ.get("TIKTOKEN_CACHE_DIR", BUNDLED_CACHE_DIR))
+    parser.add_argument('--encodings', nargs='+', default=list(ENCODING_NAMES))
+    args = parser.parse_args()
+
+    if args.command == 'prefetch':
+        prefetch_encodings(args.cache_dir, args.encodings)
+    problems = verify_encodings(args.cache_dir, args.encodings)
+    for name, problem in problems.items():
+        print(f"{name}: {problem or 'ok'}")
+    if any(problems.values()):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+DISPATCHER_TID = 0
+WRITER_TID = -1
+
+class ChromeTracer:
+    """Collects Chrome trace events ("X" complete spans) and writes them as a trace JSON file.
+
+    Dispatcher-side work (prompt generation, token counting, checkpoint writes, rate-limit
+    pauses) goes on thread 0 and background checkpoint serialization on -1. Request
+    attempts are packed into lanes 1..N so that spans on one lane never overlap, which
+    makes the lane count the concurrency of the run.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.start_time = time.time()
+        self.lane_ends = []
+
+    def complete(self, name, cat, start, end, tid=DISPATCHER_TID, args=None):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - self.start_time) * 1_000_000),
+            'dur': round((end - start) * 1_000_000),
+            'pid': 1,
+            'tid': tid,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat='dispatcher', **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.complete(name, cat, start, time.time(), args=args or None)
+
+    def lane_for(self, start, end):
+        """Returns the first request lane free at `start` and reserves it until `end`."""
+        for lane, lane_end in enumerate(self.lane_ends):
+            if lane_end <= start:
+                self.lane_ends[lane] = end
+                return lane + 1
+        self.lane_ends.append(end)
+        return len(self.lane_ends)
+
+    def attempt(self, request_id, start, end, outcome):
+        self.complete(str(request_id), 'attempt', start, end, tid=self.lane_for(start, end), args={'outcome': outcome})
+
+    def save(self, trace_file):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': DISPATCHER_TID, 'args': {'name': 'dispatcher'}},
+                    {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': WRITER_TID, 'args': {'name': 'checkpoint writer'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': lane, 'args': {'name': f'request lane {lane}'}}
+                     for lane in range(1, len(self.lane_ends) + 1)]
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}, f)
+        return trace_file
+
+def span(tracer, name, cat='dispatcher', **args):
+    """Returns tracer.span(...) or a no-op context when tracing is off."""
+    if tracer is None:
+        return nullcontext()
+    return tracer.span(name, cat, **args)
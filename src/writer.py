@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import threading
+from src import trace
+
+class CheckpointWriter:
+    """Serializes checkpoint snapshots of the results list on a background thread.
+
+    `submit` only takes a shallow copy of the list (finished result dicts are never mutated),
+    so the event loop is blocked for microseconds instead of the whole json.dump. Snapshots
+    submitted while a write is running are coalesced: only the newest one is written. Files
+    are written to a temporary path and renamed, so a crash never leaves a torn checkpoint.
+    """
+
+    def __init__(self, results_json_file, tracer=None):
+        self.results_json_file = results_json_file
+        self.tracer = tracer
+        self.condition = threading.Condition()
+        self.pending = None
+        self.writing = False
+        self.closed = False
+        self.num_writes = 0
+        self.error = None  # first failed write, re-raised from flush()/close()
+        self.thread = threading.Thread(target=self.run, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, results_list):
+        """Queues a snapshot of `results_list`; returns the seconds the caller was blocked."""
+        start = time.time()
+        snapshot = list(results_list)
+        with self.condition:
+            self.pending = snapshot
+            self.condition.notify()
+        return time.time() - start
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                snapshot, self.pending = self.pending, None
+                self.writing = True
+            start = time.time()
+            written = False
+            try:
+                write_file_atomic(snapshot, self.results_json_file)
+                written = True
+                if self.tracer:
+                    self.tracer.complete('checkpoint serialize', 'writer', start, time.time(), tid=trace.WRITER_TID, args={'items': len(snapshot)})
+            except Exception as e:
+                # Keep the thread alive so later snapshots are still tried; waiters get the error
+                if self.error is None:
+                    self.error = e
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.num_writes += written
+                    self.condition.notify_all()
+
+    def flush(self):
+        """Blocks until every submitted snapshot has been written; raises the first failed write."""
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            self.thread.join()
+
+def write_file_atomic(results_list, results_json_file):
+    tmp_file = results_json_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(results_list, f, indent=4)
+    os.replace(tmp_file, results_json_file)
+
+class OrderedWriter:
+    """Streams results to a JSON list file in input order through a bounded reorder buffer.
+
+    Results arrive tagged with their input sequence number and are written as soon as every
+    earlier one has been written. The dispatcher holds back new items while `window_full`,
+    so at most `buffer_size` finished results wait in memory. A failed result that a later
+    sweep may still retry is parked instead of blocking the stream. When the writer closes,
+    parked and late results are merged into the streamed ones by sequence number, so the
+    final file is in input order (items that never finished are simply absent).
+    """
+
+    def __init__(self, ordered_json_file, buffer_size=1000, first_seq=0):
+        self.ordered_json_file = ordered_json_file
+        self.buffer_size = buffer_size
+        self.next_seq = first_seq
+        self.buffer = {}
+        self.parked = {}
+        self.written_seqs = []
+        self.max_buffered = 0
+        self.num_written = 0
+        self.file = open(ordered_json_file, "w")
+        self.file.write("[")
+
+    def window_full(self, next_dispatch_seq):
+        """True if dispatching `next_dispatch_seq` could overflow the reorder buffer."""
+        return next_dispatch_seq - self.next_seq >= self.buffer_size
+
+    def add(self, seq, result, parked=False):
+        if seq < self.next_seq:
+            # A parked item retried by the sweep, or any other late arrival
+            self.parked[seq] = result
+            return
+        if parked:
+            self.parked[seq] = result
+            self.buffer[seq] = None
+        else:
+            self.buffer[seq] = result
+        self.max_buffered = max(self.max_buffered, len(self.buffer))
+        while self.next_seq in self.buffer:
+            result = self.buffer.pop(self.next_seq)
+            if result is not None:
+                self.write(self.next_seq, result)
+            self.next_seq += 1
+
+    def write(self, seq, result):
+        # One result per line, which lets close() merge the file back in line by line
+        self.file.write(("\n" if self.num_written == 0 else ",\n") + json.dumps(result))
+        self.written_seqs.append(seq)
+        self.num_written += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        # Items after a gap (e.g. a run stopped early) still wait in the buffer
+        for seq, result in self.buffer.items():
+            if result is not None:
+                self.parked[seq] = result
+        self.buffer.clear()
+        self.file.write("\n]\n")
+        self.file.close()
+        if self.parked:
+            self.merge_parked()
+
+    def merge_parked(self):
+        """Rewrites the file with the parked results merged in by sequence number."""
+        late = sorted(self.parked.items())
+        self.parked.clear()
+        tmp_file = self.ordered_json_file + ".tmp"
+        merged = 0
+        i = 0
+        with open(self.ordered_json_file) as streamed, open(tmp_file, "w") as out:
+            out.write("[")
+
+            def emit(result_json):
+                nonlocal merged
+                out.write(("\n" if merged == 0 else ",\n") + result_json)
+                merged += 1
+
+            lines = (line.rstrip("\n") for line in streamed)
+            next(lines)  # "["
+            for seq in self.written_seqs:
+                line = next(lines).rstrip(",")
+                while i < len(late) and late[i][0] < seq:
+                    emit(json.dumps(late[i][1]))
+                    i += 1
+                if i < len(late) and late[i][0] == seq:
+                    # A newer result for an item already streamed replaces it
+                    line = json.dumps(late[i][1])
+                    i += 1
+                emit(line)
+            for _, result in late[i:]:
+                emit(json.dumps(result))
+            out.write("\n]\n")
+        os.replace(tmp_file, self.ordered_json_file)
+        self.num_written = merged